@@ -3,28 +3,135 @@
 # A system-level, scalable direct market access platform
 
 import os
+import sys
 import json
 import datetime
 import uuid
+import hashlib
+import csv
+import io
+import decimal
+import base64
 import jwt
 import bcrypt
 import time
+import queue
+import select
+import threading
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from flask import Flask, request, jsonify, g
+from urllib.parse import urlencode, parse_qsl
+from flask import Flask, request, jsonify, g, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from flask_limiter import Limiter
+from flask_limiter import Limiter, RateLimitExceeded
 from flask_limiter.util import get_remote_address
 import psycopg2
 import psycopg2.extras
-from psycopg2.pool import ThreadedConnectionPool
+import psycopg2.errors
+from psycopg2.pool import PoolError
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, POLL_OK, POLL_READ, POLL_WRITE
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+
+# Optional shared cache backend
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Optional fast JSON encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional ASGI server for `python backend.py serve-async`
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+# JSON Serialization
+def json_default(o):
+    """Encode the database types our rows contain"""
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        # Prices have always been sent as strings such as "50.00"
+        return str(o)
+    return DefaultJSONProvider.default(o)
+
+class RowJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes database rows as-is.
+
+    Handlers pass RealDictCursor rows straight to jsonify instead of copying
+    each row and formatting its timestamps in Python. Uses orjson when it is
+    installed and the standard library otherwise.
+    """
+    default = staticmethod(json_default)
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is not None:
+            return orjson.dumps(obj, default=json_default, option=orjson.OPT_SORT_KEYS).decode('utf-8')
+        return super().dumps(obj, **kwargs)
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = RowJSONProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_secret_key_change_in_production')
 app.config['JWT_EXPIRATION_DELTA'] = datetime.timedelta(days=7)
 
+# Verified tokens are cached per worker; deactivations and role changes reach
+# every worker's revocation list within AUTH_REVOCATION_REFRESH_SECONDS
+app.config['AUTH_TOKEN_CACHE_SIZE'] = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+app.config['AUTH_REVOCATION_REFRESH_SECONDS'] = int(os.environ.get('AUTH_REVOCATION_REFRESH_SECONDS', 5))
+
+# Password hashing: bcrypt work factor, concurrent hashes per worker, and how
+# many more may wait before sign-ins are turned away with 503
+app.config['BCRYPT_ROUNDS'] = int(os.environ.get('BCRYPT_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE_SIZE'] = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 16))
+
+# Pagination defaults for list endpoints
+DEFAULT_PAGE_LIMIT = 20
+MAX_PAGE_LIMIT = 100
+
+# Text search configuration used for the product search index
+SEARCH_TEXT_CONFIG = 'english'
+app.config['SEARCH_TRGM_ENABLED'] = False
+
+# Admin exports are read in batches of this many rows from a server-side cursor.
+# Each one holds a pooled connection for the whole download, so only this many
+# run at once per worker; further requests get a 503.
+EXPORT_ITERSIZE = 2000
+app.config['EXPORT_MAX_CONCURRENT'] = int(os.environ.get('EXPORT_MAX_CONCURRENT', 2))
+
+# Response cache for public catalog reads
+app.config['CACHE_URL'] = os.environ.get('CACHE_URL')  # e.g. redis://localhost:6379/0
+app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+app.config['CACHE_TTL_SECONDS'] = int(os.environ.get('CACHE_TTL_SECONDS', 30))
+
+# Admin reports are recomputed at most once per TTL and served stale for up to
+# REPORT_CACHE_STALE_SECONDS more while a background refresh runs
+app.config['REPORT_CACHE_TTL_SECONDS'] = int(os.environ.get('REPORT_CACHE_TTL_SECONDS', 60))
+app.config['REPORT_CACHE_STALE_SECONDS'] = int(os.environ.get('REPORT_CACHE_STALE_SECONDS', 300))
+
+# Real-time chat delivery
+CHAT_NOTIFY_CHANNEL = 'chat_messages'
+CHAT_NOTIFY_MAX_BYTES = 7900  # NOTIFY payloads must stay under 8000 bytes
+CHAT_STREAM_HEARTBEAT_SECONDS = 15
+CHAT_STREAM_QUEUE_SIZE = 100
+
+# Async (ASGI) serving: connections in the asyncio pool, and threads running
+# the regular Flask routes
+app.config['ASYNC_DB_POOL_SIZE'] = int(os.environ.get('ASYNC_DB_POOL_SIZE', 20))
+app.config['ASYNC_WSGI_THREADS'] = int(os.environ.get('ASYNC_WSGI_THREADS', 32))
+
 # Configure CORS
-CORS(app, resources={r"/*": {"origins": "*"}})  # Restrict in production
+CORS_ORIGINS = "*"  # Restrict in production
+CORS(app, resources={r"/*": {"origins": CORS_ORIGINS}})
 
 # Configure Rate Limiting
 limiter = Limiter(
@@ -42,33 +149,265 @@ DB_CONFIG = {
     'port': os.environ.get('DB_PORT')
 }
 # Database Connection Pool
-try:
-    db_pool = ThreadedConnectionPool(
-        minconn=1,
-        maxconn=10,
-        **DB_CONFIG
-    )
-except psycopg2.Error as e:
-    print(f"Error connecting to PostgreSQL: {e}")
-    raise
+# Sizes and timeouts are per worker process
+app.config['DB_POOL_MIN'] = int(os.environ.get('DB_POOL_MIN', 1))
+app.config['DB_POOL_MAX'] = int(os.environ.get('DB_POOL_MAX', 10))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 5))  # max wait for a free connection
+app.config['DB_POOL_PING_AFTER'] = float(os.environ.get('DB_POOL_PING_AFTER', 30))  # idle seconds before a checkout pings
+app.config['DB_POOL_MAX_IDLE'] = float(os.environ.get('DB_POOL_MAX_IDLE', 300))  # idle seconds before closing, above DB_POOL_MIN
+app.config['DB_POOL_MAX_LIFETIME'] = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))
+
+class PoolTimeout(PoolError):
+    """Raised when no connection frees up within DB_POOL_TIMEOUT"""
+
+class ConnectionPool:
+    """Thread-safe Postgres connection pool, private to each process.
+
+    Connections are opened on demand up to maxconn; beyond that, callers wait
+    up to `timeout` seconds for one to be returned. Connections idle for a
+    while are pinged before reuse and old ones are recycled. A connection
+    returned mid-transaction is rolled back, and one in an unknown state is
+    closed. After a fork the child starts with an empty pool, so workers never
+    share a socket with the master or each other.
+
+    Implements the getconn/putconn/closeall API of psycopg2's pools.
+    """
+    
+    def __init__(self, dsn_config, minconn, maxconn, timeout, ping_after, max_idle, max_lifetime):
+        self.dsn_config = dsn_config
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        # Connections inherited across a fork; never closed in the child, as
+        # that would terminate the parent's session on the shared socket
+        self.inherited = []
+        self.reset()
+    
+    def reset(self):
+        self.pid = os.getpid()
+        self.available = threading.Condition(threading.Lock())
+        self.idle = []  # (conn, idle since), most recently returned last
+        self.opened_at = {}
+        self.size = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+    
+    def after_fork(self):
+        self.inherited.extend(self.opened_at)
+        self.reset()
+    
+    def getconn(self, key=None):
+        started = time.monotonic()
+        with self.available:
+            if self.size >= self.maxconn and not self.idle:
+                self.waiting += 1
+                try:
+                    while self.size >= self.maxconn and not self.idle:
+                        remaining = started + self.timeout - time.monotonic()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise PoolTimeout(f"No database connection available within {self.timeout:g}s")
+                        self.available.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            
+            self.checkouts += 1
+            self.wait_seconds += time.monotonic() - started
+            self.in_use += 1
+            if self.idle:
+                conn, idle_since = self.idle.pop()
+            else:
+                conn, idle_since = None, None
+                self.size += 1
+        
+        try:
+            if conn is not None and not self.healthy(conn, idle_since):
+                self.close(conn)
+                conn = None
+            if conn is None:
+                conn = psycopg2.connect(**self.dsn_config)
+                self.opened_at[conn] = time.monotonic()
+            return conn
+        except Exception:
+            with self.available:
+                self.size -= 1
+                self.in_use -= 1
+                self.available.notify()
+            raise
+    
+    def healthy(self, conn, idle_since):
+        if conn.closed or time.monotonic() - self.opened_at.get(conn, 0) > self.max_lifetime:
+            return False
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+    
+    def putconn(self, conn, key=None, close=False):
+        # Connections checked out before a fork belong to the parent
+        if conn not in self.opened_at:
+            return
+        
+        discard = close or conn.closed or time.monotonic() - self.opened_at[conn] > self.max_lifetime
+        if not discard:
+            try:
+                status = conn.info.transaction_status
+                if status == TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if not discard and conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                discard = True
+        
+        expired = []
+        with self.available:
+            self.in_use -= 1
+            if discard:
+                self.size -= 1
+            else:
+                self.idle.append((conn, time.monotonic()))
+                # Shrink back towards minconn, oldest-idle first
+                now = time.monotonic()
+                while len(self.idle) > self.minconn and now - self.idle[0][1] > self.max_idle:
+                    expired.append(self.idle.pop(0)[0])
+                    self.size -= 1
+            self.available.notify()
+        
+        if discard:
+            self.close(conn)
+        for idle_conn in expired:
+            self.close(idle_conn)
+    
+    def close(self, conn):
+        self.opened_at.pop(conn, None)
+        if not conn.closed:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+    
+    def closeall(self):
+        with self.available:
+            idle = [conn for conn, _ in self.idle]
+            self.size -= len(idle)
+            self.idle = []
+        for conn in idle:
+            self.close(conn)
+    
+    def stats(self):
+        with self.available:
+            return {
+                'in_use': self.in_use,
+                'idle': len(self.idle),
+                'waiting': self.waiting,
+                'max': self.maxconn,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds': self.wait_seconds,
+            }
+
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    minconn=app.config['DB_POOL_MIN'],
+    maxconn=app.config['DB_POOL_MAX'],
+    timeout=app.config['DB_POOL_TIMEOUT'],
+    ping_after=app.config['DB_POOL_PING_AFTER'],
+    max_idle=app.config['DB_POOL_MAX_IDLE'],
+    max_lifetime=app.config['DB_POOL_MAX_LIFETIME']
+)
+os.register_at_fork(after_in_child=db_pool.after_fork)
 
 # Helper function to get database connection from pool
+# The connection is checked out on first use, not when the request starts
 def get_db_connection():
     if not hasattr(g, 'db_conn'):
         g.db_conn = db_pool.getconn()
     return g.db_conn
 
+def release_db_connection():
+    """Hand the request's connection back as soon as its last query is done.
+
+    Any open transaction is rolled back, so commit first, and do not touch
+    the old connection or its cursors' results afterwards. A later
+    get_db_connection() in the same request checks out another one.
+    """
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        db_pool.putconn(conn)
+
 # Return connection to the pool when request is done
 @app.teardown_appcontext
 def close_db_connection(exception):
-    if hasattr(g, 'db_conn'):
-        db_pool.putconn(g.db_conn)
+    release_db_connection()
 
-# Initialize database tables
-def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+@app.errorhandler(PoolTimeout)
+def pool_timeout(e):
+    response = jsonify({'message': 'The server is busy. Please try again shortly.'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# Managed index set, as (name, "table (columns) [WHERE ...]") pairs
+DB_INDEXES = [
+    # Catalog keyset pages; the partial predicate covers (is_approved, is_available, created_at)
+    ('idx_products_catalog_page', 'products (created_at DESC, id DESC) WHERE is_approved = true AND is_available = true'),
+    ('idx_products_created_page', 'products (created_at DESC, id DESC)'),
+    # Also serves products.farmer_id lookups and the foreign key
+    ('idx_products_farmer_page', 'products (farmer_id, created_at DESC, id DESC)'),
+    
+    # Order history pages; idx_orders_buyer_page also serves orders.buyer_id
+    ('idx_orders_buyer_page', 'orders (buyer_id, created_at DESC, id DESC)'),
+    ('idx_orders_created_page', 'orders (created_at DESC, id DESC)'),
+    ('idx_orders_status_page', 'orders (status, created_at DESC, id DESC)'),
+    
+    # Order item foreign keys: per-order hydration, farmer order lists and product deletes
+    ('idx_order_items_order', 'order_items (order_id)'),
+    ('idx_order_items_farmer', 'order_items (farmer_id, order_id)'),
+    ('idx_order_items_product', 'order_items (product_id)'),
+    
+    # Conversation history per direction, and the receiver side of the inbox
+    ('idx_chats_pair_created', 'chats (sender_id, receiver_id, created_at, id)'),
+    ('idx_chats_receiver_created', 'chats (receiver_id, created_at, id)'),
+    # Unread counts only ever look at unread rows
+    ('idx_chats_unread', 'chats (receiver_id, sender_id) WHERE is_read = false'),
+    
+    # User growth windows count signups by creation time
+    ('idx_users_created', 'users (created_at)'),
+    # Token revocation polling reads recently changed users
+    ('idx_users_updated', 'users (updated_at)'),
+    
+    # Top-products windows scan counters by day
+    ('idx_product_sales_daily_day', 'product_sales_daily (day, product_id) INCLUDE (quantity)'),
+    
+    ('idx_product_search_document', 'product_search USING GIN (document)'),
+]
+
+# Indexes that need the pg_trgm extension
+TRGM_INDEXES = [
+    ('idx_product_search_name_trgm', 'product_search USING GIN (name gin_trgm_ops)'),
+]
+
+# Schema Migrations
+# Each migration runs once, in order, inside its own transaction and is
+# recorded in schema_version. Add new schema changes as a new entry rather
+# than editing an applied one. Indexes live in DB_INDEXES instead, because
+# they are built concurrently outside a transaction.
+MIGRATION_LOCK_ID = 7262601  # pg_advisory_lock key serialising migration runs
+
+def migrate_core_tables(cursor):
     # Create Users Table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -147,13 +486,701 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
+
+def migrate_product_search(cursor):
+    # Create Product Search Table, kept in sync with products by a trigger so
+    # that SELECT p.* responses stay unchanged
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_search (
+        product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        document TSVECTOR NOT NULL
+    )
+    ''')
+    
+    cursor.execute(f'''
+    CREATE OR REPLACE FUNCTION refresh_product_search() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO product_search (product_id, name, document)
+        VALUES (
+            NEW.id,
+            NEW.name,
+            setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(NEW.category, '')), 'B') ||
+            setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(NEW.description, '')), 'C')
+        )
+        ON CONFLICT (product_id) DO UPDATE
+            SET name = EXCLUDED.name, document = EXCLUDED.document;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_products_search ON products')
+    cursor.execute('''
+    CREATE TRIGGER trg_products_search
+        AFTER INSERT OR UPDATE OF name, category, description ON products
+        FOR EACH ROW EXECUTE FUNCTION refresh_product_search()
+    ''')
+    # Backfill products that existed before the search table
+    cursor.execute(f'''
+    INSERT INTO product_search (product_id, name, document)
+    SELECT id, name,
+           setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(name, '')), 'A') ||
+           setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(category, '')), 'B') ||
+           setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(description, '')), 'C')
+    FROM products
+    ON CONFLICT (product_id) DO NOTHING
+    ''')
+
+def migrate_trigram_extension(cursor):
+    # Trigram matching for misspelled crop names needs the pg_trgm extension,
+    # which may require elevated privileges. Search still works without it,
+    # and run_migrations() retries it while it is missing.
+    cursor.execute('SAVEPOINT trgm_extension')
+    try:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except psycopg2.Error as e:
+        cursor.execute('ROLLBACK TO SAVEPOINT trgm_extension')
+        print(f"pg_trgm unavailable, typo-tolerant search disabled: {e}")
+
+def migrate_order_idempotency(cursor):
+    # Collision-free order numbers and per-buyer Idempotency-Key replay
+    cursor.execute('CREATE SEQUENCE IF NOT EXISTS order_number_seq')
+    cursor.execute('ALTER TABLE orders ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(255)')
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_idempotency_key
+        ON orders (buyer_id, idempotency_key)
+        WHERE idempotency_key IS NOT NULL
+    ''')
+
+def migrate_change_versions(cursor):
+    # Per-scope change counters, bumped by triggers in the writing transaction,
+    # used to derive ETags without reading the underlying rows
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS change_versions (
+        scope VARCHAR(100) PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    ''')
+    
+    # Scopes are locked in sorted order so concurrent bumps cannot deadlock
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION bump_change_versions(scopes TEXT[]) RETURNS void AS $$
+        INSERT INTO change_versions (scope, version)
+        SELECT scope, 1 FROM (SELECT DISTINCT unnest(scopes) AS scope) s ORDER BY scope
+        ON CONFLICT (scope) DO UPDATE SET version = change_versions.version + 1
+    $$ LANGUAGE sql
+    ''')
+    
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION bump_scopes_trigger() RETURNS trigger AS $$
+    BEGIN
+        PERFORM bump_change_versions(TG_ARGV::TEXT[]);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+    
+    # Order changes bump the global scope and the scope of every buyer and farmer involved
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION order_items_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM bump_change_versions(ARRAY(
+            SELECT 'orders'
+            UNION SELECT 'orders:user:' || o.buyer_id FROM new_rows n JOIN orders o ON o.id = n.order_id WHERE o.buyer_id IS NOT NULL
+            UNION SELECT 'orders:user:' || n.farmer_id FROM new_rows n WHERE n.farmer_id IS NOT NULL
+        ));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION orders_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM bump_change_versions(ARRAY(
+            SELECT 'orders'
+            UNION SELECT 'orders:user:' || n.buyer_id FROM new_rows n WHERE n.buyer_id IS NOT NULL
+            UNION SELECT 'orders:user:' || oi.farmer_id FROM new_rows n JOIN order_items oi ON oi.order_id = n.id WHERE oi.farmer_id IS NOT NULL
+        ));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+    
+    triggers = [
+        ('trg_products_version', 'products', "AFTER INSERT OR UPDATE OR DELETE ON products FOR EACH STATEMENT EXECUTE FUNCTION bump_scopes_trigger('products')"),
+        # Order payloads only embed a product's name and image
+        ('trg_product_labels_version', 'products', "AFTER UPDATE OF name, image_url OR DELETE ON products FOR EACH STATEMENT EXECUTE FUNCTION bump_scopes_trigger('product_labels')"),
+        ('trg_users_version', 'users', "AFTER INSERT OR UPDATE OR DELETE ON users FOR EACH STATEMENT EXECUTE FUNCTION bump_scopes_trigger('users')"),
+        # Orders are always inserted together with their items, so inserts are tracked on order_items
+        ('trg_order_items_insert_version', 'order_items', "AFTER INSERT ON order_items REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION order_items_changed()"),
+        ('trg_order_items_update_version', 'order_items', "AFTER UPDATE ON order_items REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION order_items_changed()"),
+        ('trg_orders_update_version', 'orders', "AFTER UPDATE ON orders REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION orders_changed()"),
+    ]
+    for name, table, definition in triggers:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name} ON {table}')
+        cursor.execute(f'CREATE TRIGGER {name} {definition}')
+
+def migrate_sales_rollups(cursor):
+    # Hourly and daily order totals per status, so sales reports never scan orders
+    for table in ('sales_rollup_hourly', 'sales_rollup_daily'):
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            bucket_start TIMESTAMP NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            total_amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket_start, status)
+        )
+        ''')
+    
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION apply_sales_rollup(ts TIMESTAMP, order_status TEXT, count_delta INTEGER, amount_delta DECIMAL) 
+    RETURNS void AS $$
+        INSERT INTO sales_rollup_hourly (bucket_start, status, order_count, total_amount)
+        VALUES (date_trunc('hour', ts), order_status, count_delta, amount_delta)
+        ON CONFLICT (bucket_start, status) DO UPDATE 
+            SET order_count = sales_rollup_hourly.order_count + EXCLUDED.order_count,
+                total_amount = sales_rollup_hourly.total_amount + EXCLUDED.total_amount;
+        INSERT INTO sales_rollup_daily (bucket_start, status, order_count, total_amount)
+        VALUES (date_trunc('day', ts), order_status, count_delta, amount_delta)
+        ON CONFLICT (bucket_start, status) DO UPDATE 
+            SET order_count = sales_rollup_daily.order_count + EXCLUDED.order_count,
+                total_amount = sales_rollup_daily.total_amount + EXCLUDED.total_amount;
+    $$ LANGUAGE sql
+    ''')
+    
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION orders_sales_rollup() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM apply_sales_rollup(OLD.created_at, OLD.status, -1, -OLD.total_amount);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM apply_sales_rollup(NEW.created_at, NEW.status, 1, NEW.total_amount);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+    
+    # Deferred to commit time so the shared current-hour rollup row is locked
+    # only while a checkout commits, not for the whole checkout transaction
+    cursor.execute('DROP TRIGGER IF EXISTS trg_orders_sales_rollup ON orders')
+    cursor.execute('''
+    CREATE CONSTRAINT TRIGGER trg_orders_sales_rollup
+        AFTER INSERT OR DELETE OR UPDATE OF status, total_amount, created_at ON orders
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION orders_sales_rollup()
+    ''')
+    
+    # Backfill from existing orders; the trigger's table lock keeps writers out until commit
+    for table, unit in (('sales_rollup_hourly', 'hour'), ('sales_rollup_daily', 'day')):
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(f'''
+        INSERT INTO {table} (bucket_start, status, order_count, total_amount)
+        SELECT date_trunc('{unit}', created_at), status, COUNT(*), COALESCE(SUM(total_amount), 0)
+        FROM orders
+        GROUP BY 1, 2
+        ''')
+
+def migrate_product_sales_daily(cursor):
+    # Per-product, per-day units and revenue of items that were not rejected,
+    # backing the top-products leaderboard. Rows are keyed by product id only,
+    # so deleted products simply drop out when joined back to products.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_sales_daily (
+        product_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (product_id, day)
+    )
+    ''')
     
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION order_items_product_sales() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.product_id IS NOT NULL AND OLD.status != 'rejected' THEN
+            INSERT INTO product_sales_daily (product_id, day, quantity, revenue)
+            VALUES (OLD.product_id, OLD.created_at::date, -OLD.quantity, -OLD.total_price)
+            ON CONFLICT (product_id, day) DO UPDATE 
+                SET quantity = product_sales_daily.quantity + EXCLUDED.quantity,
+                    revenue = product_sales_daily.revenue + EXCLUDED.revenue;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.product_id IS NOT NULL AND NEW.status != 'rejected' THEN
+            INSERT INTO product_sales_daily (product_id, day, quantity, revenue)
+            VALUES (NEW.product_id, NEW.created_at::date, NEW.quantity, NEW.total_price)
+            ON CONFLICT (product_id, day) DO UPDATE 
+                SET quantity = product_sales_daily.quantity + EXCLUDED.quantity,
+                    revenue = product_sales_daily.revenue + EXCLUDED.revenue;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+    
+    # Deferred like the sales rollup, so counter rows are only locked at commit
+    cursor.execute('DROP TRIGGER IF EXISTS trg_order_items_product_sales ON order_items')
+    cursor.execute('''
+    CREATE CONSTRAINT TRIGGER trg_order_items_product_sales
+        AFTER INSERT OR DELETE OR UPDATE OF status, product_id, quantity, total_price, created_at ON order_items
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION order_items_product_sales()
+    ''')
+    
+    cursor.execute('DELETE FROM product_sales_daily')
+    cursor.execute('''
+    INSERT INTO product_sales_daily (product_id, day, quantity, revenue)
+    SELECT product_id, created_at::date, SUM(quantity), SUM(total_price)
+    FROM order_items
+    WHERE product_id IS NOT NULL AND status != 'rejected'
+    GROUP BY 1, 2
+    ''')
+
+def migrate_token_revocation(cursor):
+    # Tokens issued before tokens_valid_after are refused; it is stamped whenever
+    # a user is deactivated or changes role, whichever endpoint does it
+    cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS tokens_valid_after TIMESTAMPTZ')
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION users_revoke_tokens() RETURNS trigger AS $$
+    BEGIN
+        IF (NEW.is_active IS DISTINCT FROM OLD.is_active AND NOT COALESCE(NEW.is_active, false))
+                OR NEW.role IS DISTINCT FROM OLD.role THEN
+            NEW.tokens_valid_after := now();
+            NEW.updated_at := CURRENT_TIMESTAMP;
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_users_revoke_tokens ON users')
+    cursor.execute('''
+    CREATE TRIGGER trg_users_revoke_tokens
+        BEFORE UPDATE OF is_active, role ON users
+        FOR EACH ROW EXECUTE FUNCTION users_revoke_tokens()
+    ''')
+
+def migrate_user_labels_version(cursor):
+    # Catalog and order payloads only embed a user's name and phone, so bump
+    # their ETag scope on those changes rather than on every write to users
+    cursor.execute('DROP TRIGGER IF EXISTS trg_users_version ON users')
+    cursor.execute('DROP TRIGGER IF EXISTS trg_user_labels_version ON users')
+    cursor.execute('''
+    CREATE TRIGGER trg_user_labels_version
+        AFTER UPDATE OF full_name, phone OR DELETE ON users
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_scopes_trigger('user_labels')
+    ''')
+
+def migrate_order_items_version_scopes(cursor):
+    # An order's payload lists every item, so an item change has to bump the
+    # scope of every farmer in that order, not only the farmer who owns the item
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION order_items_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM bump_change_versions(ARRAY(
+            SELECT 'orders'
+            UNION SELECT 'orders:user:' || o.buyer_id FROM new_rows n JOIN orders o ON o.id = n.order_id WHERE o.buyer_id IS NOT NULL
+            UNION SELECT 'orders:user:' || oi.farmer_id FROM new_rows n JOIN order_items oi ON oi.order_id = n.order_id WHERE oi.farmer_id IS NOT NULL
+        ));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+
+MIGRATIONS = [
+    (1, 'Create users, products, orders, order_items and chats tables', migrate_core_tables),
+    (2, 'Create product_search table and refresh trigger', migrate_product_search),
+    (3, 'Enable pg_trgm for typo-tolerant search', migrate_trigram_extension),
+    (4, 'Add order number sequence and order idempotency keys', migrate_order_idempotency),
+    (5, 'Add change_versions counters for ETags', migrate_change_versions),
+    (6, 'Add hourly and daily sales rollups', migrate_sales_rollups),
+    (7, 'Add per-product daily sales counters', migrate_product_sales_daily),
+    (8, 'Add token revocation cutoffs to users', migrate_token_revocation),
+    (9, 'Narrow the users ETag scope to name and phone changes', migrate_user_labels_version),
+    (10, 'Bump every farmer in an order when one of its items changes', migrate_order_items_version_scopes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(cursor):
+    """Return the applied schema version, or 0 for an unmigrated database"""
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+def detect_search_features(cursor):
+    """Enable trigram search when the pg_trgm extension is installed"""
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+    app.config['SEARCH_TRGM_ENABLED'] = cursor.fetchone()[0]
+
+def run_migrations():
+    """Apply pending migrations, then build any missing indexes"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
     conn.commit()
-    cursor.close()
+    
+    # Only one migration run at a time, e.g. when several hosts deploy together
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        current_version = get_schema_version(cursor)
+        for version, description, migration in MIGRATIONS:
+            if version <= current_version:
+                continue
+            
+            print(f"Applying migration {version}: {description}")
+            migration(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            conn.commit()
+        
+        detect_search_features(cursor)
+        if not app.config['SEARCH_TRGM_ENABLED']:
+            # Migration 3 is recorded even if the extension could not be
+            # created, e.g. before it was allowed, so try again on every run
+            migrate_trigram_extension(cursor)
+            detect_search_features(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+        cursor.close()
+    
+    indexes = DB_INDEXES + (TRGM_INDEXES if app.config['SEARCH_TRGM_ENABLED'] else [])
+    ensure_indexes(conn, indexes)
+    
+    print(f"Database schema is at version {SCHEMA_VERSION}")
 
-# Initialize database on startup
-with app.app_context():
-    init_db() 
+def check_schema_version():
+    """Verify at startup that the database has been migrated; no DDL runs here"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        current_version = get_schema_version(cursor)
+        if current_version < SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Database schema is at version {current_version} but this build needs "
+                f"version {SCHEMA_VERSION}. Run `python backend.py migrate` first."
+            )
+        
+        detect_search_features(cursor)
+    finally:
+        cursor.close()
+        conn.rollback()
+
+def ensure_indexes(conn, indexes):
+    """Create missing indexes with CREATE INDEX CONCURRENTLY.
+
+    Builds run outside a transaction so existing deployments keep serving
+    writes while an index is added. An invalid index left behind by an
+    interrupted concurrent build is dropped and rebuilt.
+    """
+    conn.autocommit = True
+    cursor = conn.cursor()
+    
+    try:
+        for name, definition in indexes:
+            cursor.execute(
+                '''SELECT i.indisvalid FROM pg_class c 
+                   JOIN pg_index i ON i.indexrelid = c.oid 
+                   WHERE c.relname = %s''',
+                (name,)
+            )
+            existing = cursor.fetchone()
+            
+            if existing and existing[0]:
+                continue
+            
+            if existing:
+                print(f"Rebuilding invalid index {name}")
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            
+            print(f"Creating index {name}")
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}')
+    finally:
+        cursor.close()
+        conn.autocommit = False
+
+# Response Cache
+class MemoryCache:
+    """In-process cache with LRU eviction and per-entry TTL.
+
+    Each worker has its own copy, so invalidations reach other workers only
+    when their entries expire. Use a shared backend when that matters.
+    """
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def get_counter(self, key):
+        # Counters are kept apart from entries so LRU eviction never resets them
+        with self.lock:
+            return self.counters.get(key, 0)
+    
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+class RedisCache:
+    """Cache shared by all workers, backed by any client with the redis-py API.
+
+    A backend outage is treated as a cache miss rather than a failed request.
+    """
+    
+    def __init__(self, client):
+        self.client = client
+    
+    def get(self, key):
+        try:
+            return self.client.get(key)
+        except Exception as e:
+            print(f"Cache get failed: {e}")
+            return None
+    
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(key, value, ex=ttl)
+        except Exception as e:
+            print(f"Cache set failed: {e}")
+    
+    def get_counter(self, key):
+        try:
+            return int(self.client.get(key) or 0)
+        except Exception as e:
+            print(f"Cache get failed: {e}")
+            return 0
+    
+    def incr(self, key):
+        try:
+            return self.client.incr(key)
+        except Exception as e:
+            print(f"Cache incr failed: {e}")
+
+def create_cache():
+    """Build the configured cache backend"""
+    if app.config['CACHE_URL']:
+        if redis is None:
+            raise RuntimeError('CACHE_URL is set but the redis package is not installed')
+        return RedisCache(redis.Redis.from_url(app.config['CACHE_URL']))
+    return MemoryCache(app.config['CACHE_MAX_ENTRIES'])
+
+response_cache = create_cache()
+
+def product_list_cache_key():
+    """Key a product listing on its normalized query parameters"""
+    args = urlencode(sorted(request.args.items(multi=True)))
+    return (f"products:{response_cache.get_counter('products:gen:all')}"
+            f":list:{response_cache.get_counter('products:gen:list')}:{args}")
+
+def product_detail_cache_key(product_id):
+    return (f"products:{response_cache.get_counter('products:gen:all')}"
+            f":detail:{response_cache.get_counter(f'products:gen:detail:{product_id}')}:{product_id}")
+
+def invalidate_product_cache(product_ids=None):
+    """Drop cached catalog responses after a write.
+
+    With product ids, every listing plus those products' detail entries are
+    invalidated. Without, everything is, e.g. when a farmer's name changes.
+    Entries are never deleted but moved to a new generation, so a reader that
+    loaded the old row before the write cannot store it under a live key.
+    """
+    if product_ids is None:
+        response_cache.incr('products:gen:all')
+        return
+    
+    response_cache.incr('products:gen:list')
+    for product_id in product_ids:
+        response_cache.incr(f'products:gen:detail:{product_id}')
+
+def cached_response(make_key):
+    """Serve a route's successful JSON responses from the response cache.
+
+    The response's ETag is cached with the body, so a matching If-None-Match
+    is answered with 304 straight from the cache.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = make_key(*args, **kwargs)
+            cached = response_cache.get(key)
+            if cached is not None:
+                etag, body = cached.split(b'\n', 1)
+                if etag and request.if_none_match.contains(etag.decode('ascii')):
+                    response = not_modified_response(etag.decode('ascii'))
+                else:
+                    response = app.response_class(body, status=200, mimetype='application/json')
+                    if etag:
+                        response.set_etag(etag.decode('ascii'))
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                etag = (response.get_etag()[0] or '').encode('ascii')
+                response_cache.set(key, etag + b'\n' + response.get_data(), app.config['CACHE_TTL_SECONDS'])
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return decorated
+    return decorator
+
+class ReportCache:
+    """Per-worker cache of serialized admin reports with stale-while-revalidate.
+
+    Fresh entries are served as is. Stale ones are served while one background
+    thread recomputes them, and concurrent misses on a key wait for a single
+    computation instead of each running the report.
+    """
+    
+    def __init__(self, ttl, stale_ttl):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.entries = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+    
+    def get(self, key, build):
+        """Return (body, state) where state is HIT, STALE or MISS"""
+        with self.lock:
+            entry = self.entries.get(key)
+            age = time.monotonic() - entry[1] if entry else None
+            if entry and age < self.ttl:
+                return entry[0], 'HIT'
+            
+            flight = self.inflight.get(key)
+            if entry and age < self.ttl + self.stale_ttl:
+                if flight is None:
+                    self.inflight[key] = threading.Event()
+                    threading.Thread(target=self.refresh, args=(key, build), daemon=True).start()
+                return entry[0], 'STALE'
+            
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = threading.Event()
+        
+        if leader:
+            return self.compute(key, build, flight), 'MISS'
+        
+        # Another request is computing this report; if it fails, try again
+        flight.wait()
+        return self.get(key, build)
+    
+    def compute(self, key, build, flight):
+        try:
+            body = app.json.dumps(build())
+            with self.lock:
+                self.entries[key] = (body, time.monotonic())
+            return body
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            flight.set()
+    
+    def refresh(self, key, build):
+        # Runs outside any request, so give the report its own app context and connection
+        with app.app_context():
+            try:
+                self.compute(key, build, self.inflight[key])
+            except Exception as e:
+                print(f"Report refresh failed for {key}: {str(e)}")
+
+report_cache = ReportCache(app.config['REPORT_CACHE_TTL_SECONDS'], app.config['REPORT_CACHE_STALE_SECONDS'])
+
+# Conditional Requests
+def read_change_versions(scopes):
+    """Fetch the change counters for the given scopes in one query"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT scope, version FROM change_versions WHERE scope = ANY(%s)",
+            (list(scopes),)
+        )
+        versions = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+    return [versions.get(scope, 0) for scope in scopes]
+
+def not_modified_response(etag):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+def conditional_response(scopes):
+    """Answer If-None-Match with 304 when none of the data behind a route changed.
+
+    scopes is a list of change_versions scopes, or a function of current_user
+    returning one. The strong ETag combines their counters with the request
+    path, query and, for authenticated routes, the caller's token, and is
+    computed before the handler runs, so a 304 never touches the body.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            current_user = args[0] if args else None
+            route_scopes = scopes(current_user) if callable(scopes) else scopes
+            
+            signature = [request.path, urlencode(sorted(request.args.items(multi=True)))]
+            if current_user is not None:
+                signature.append(request.headers.get('Authorization', ''))
+            signature.extend(str(version) for version in read_change_versions(route_scopes))
+            etag = hashlib.sha1('|'.join(signature).encode('utf-8')).hexdigest()
+            
+            if request.if_none_match.contains(etag):
+                release_db_connection()
+                return not_modified_response(etag)
+            
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return decorated
+    return decorator
+
+def order_etag_scopes(current_user):
+    """Admins see every order; buyers and farmers only the orders they are part of"""
+    if current_user['role'] == 'admin':
+        orders_scope = 'orders'
+    else:
+        orders_scope = f"orders:user:{current_user['id']}"
+    return [orders_scope, 'user_labels', 'product_labels']
 
 # Authentication Middleware & Helpers
 def generate_jwt(user_id, role):
@@ -166,31 +1193,131 @@ def generate_jwt(user_id, role):
     }
     return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
 
+class TokenRevocations:
+    """Per-worker list of users whose existing tokens must be refused.
+
+    Maps a user id to an issued-at cutoff in epoch seconds: tokens issued
+    before it are rejected, and a deactivated user's cutoff is infinite. The
+    list is polled from users rows changed since the previous refresh.
+    """
+    
+    # Re-read rows changed this long before the last poll, to catch
+    # transactions that committed after it with an earlier updated_at
+    OVERLAP = datetime.timedelta(seconds=60)
+    
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self.cutoffs = {}
+        self.watermark = None
+        self.next_refresh = 0
+        self.lock = threading.Lock()
+    
+    def is_revoked(self, user_id, issued_at):
+        cutoff = self.cutoffs.get(user_id)
+        return cutoff is not None and issued_at < cutoff
+    
+    def revoke(self, user_id):
+        """Refuse every token of a user straight away in this worker"""
+        self.cutoffs[user_id] = float('inf')
+    
+    def refresh(self, force=False):
+        # One request refreshes while the others carry on with the current list
+        if not force and time.monotonic() < self.next_refresh:
+            return
+        if not self.lock.acquire(blocking=force):
+            return
+        
+        cursor = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT LOCALTIMESTAMP")
+            polled_at = cursor.fetchone()[0]
+            
+            if self.watermark is None:
+                cursor.execute(
+                    """SELECT id, is_active, extract(epoch FROM tokens_valid_after) FROM users 
+                       WHERE NOT COALESCE(is_active, false) OR tokens_valid_after > now() - %s""",
+                    (app.config['JWT_EXPIRATION_DELTA'],)
+                )
+            else:
+                cursor.execute(
+                    "SELECT id, is_active, extract(epoch FROM tokens_valid_after) FROM users WHERE updated_at >= %s",
+                    (self.watermark - self.OVERLAP,)
+                )
+            
+            for user_id, is_active, valid_after in cursor.fetchall():
+                if not is_active:
+                    self.cutoffs[user_id] = float('inf')
+                elif valid_after is not None:
+                    self.cutoffs[user_id] = int(valid_after)
+                else:
+                    self.cutoffs.pop(user_id, None)
+            
+            self.watermark = polled_at
+            self.next_refresh = time.monotonic() + self.refresh_seconds
+        except Exception as e:
+            # Keep the current list and retry on the next request
+            print(f"Token revocation refresh failed: {str(e)}")
+        finally:
+            if cursor is not None:
+                cursor.close()
+            self.lock.release()
+
+token_cache = MemoryCache(app.config['AUTH_TOKEN_CACHE_SIZE'])
+token_revocations = TokenRevocations(app.config['AUTH_REVOCATION_REFRESH_SECONDS'])
+
+def verify_token(token):
+    """Decode a token, or return its cached claims if it was verified before.
+
+    Entries are keyed by the token's hash and expire with the token itself,
+    so an expired token always falls through to jwt.decode.
+    """
+    key = hashlib.sha256(token.encode('utf-8')).digest()
+    cached = token_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+    claims = ({'id': data['sub'], 'role': data['role']}, data.get('iat', 0))
+    ttl = data['exp'] - time.time() if 'exp' in data else 0
+    if ttl > 0:
+        token_cache.set(key, claims, ttl)
+    return claims
+
+def authenticate(auth_header):
+    """Resolve an Authorization header to (current_user, None), or (None, error message)"""
+    token = None
+    if auth_header:
+        try:
+            token = auth_header.split(" ")[1]
+        except IndexError:
+            return None, 'Token is missing!'
+
+    if not token:
+        return None, 'Token is missing!'
+
+    try:
+        user, issued_at = verify_token(token)
+    except jwt.ExpiredSignatureError:
+        return None, 'Token has expired!'
+    except jwt.InvalidTokenError:
+        return None, 'Invalid token!'
+    
+    token_revocations.refresh()
+    if token_revocations.is_revoked(user['id'], issued_at):
+        return None, 'Token has been revoked!'
+
+    # Handlers may modify current_user, so give each request its own copy
+    return dict(user), None
+
 def token_required(f):
     """Decorator to protect routes that require authentication"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            try:
-                token = auth_header.split(" ")[1]
-            except IndexError:
-                return jsonify({'message': 'Token is missing!'}), 401
-
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
-
-        try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = {
-                'id': data['sub'],
-                'role': data['role']
-            }
-        except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token has expired!'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'message': 'Invalid token!'}), 401
+        current_user, error = authenticate(request.headers.get('Authorization'))
+        if error:
+            return jsonify({'message': error}), 401
 
         return f(current_user, *args, **kwargs)
     return decorated
@@ -206,9 +1333,209 @@ def role_required(roles):
         return decorated_function
     return decorator
 
-@app.route('/', methods=['GET'])
-def get_root():
-    return jsonify({'message': 'Welcome to the Annvahak API!'}), 200
+# Pagination Helpers
+def encode_cursor(created_at, row_id):
+    """Encode a (created_at, id) keyset position as an opaque cursor string"""
+    raw = json.dumps([created_at.isoformat(), row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor_value):
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor_value.encode('ascii')))
+        return datetime.datetime.fromisoformat(created_at), int(row_id)
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise ValueError('Invalid cursor')
+
+def get_page_args():
+    """Read ?limit= and ?cursor= from the request.
+
+    Returns (limit, after) where limit is None when the client did not ask for
+    pagination, so older clients keep receiving the full list.
+    """
+    cursor_value = request.args.get('cursor')
+    
+    if request.args.get('limit') is None and cursor_value is None:
+        return None, None
+    
+    limit = get_limit_arg(DEFAULT_PAGE_LIMIT)
+    after = decode_cursor(cursor_value) if cursor_value else None
+    return limit, after
+
+def get_limit_arg(default=None):
+    """Read ?limit= capped at MAX_PAGE_LIMIT, raising ValueError if it is invalid"""
+    limit = request.args.get('limit')
+    if limit is None:
+        return default
+    
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError('Invalid limit')
+    if limit < 1:
+        raise ValueError('Invalid limit')
+    return min(limit, MAX_PAGE_LIMIT)
+
+def get_id_arg(name):
+    """Read an optional integer id query parameter, raising ValueError if it is invalid"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name}')
+
+def apply_keyset_page(query, params, limit, after, alias):
+    """Append the keyset condition, ordering and LIMIT for a (created_at, id) page"""
+    if after:
+        query += f" AND ({alias}.created_at, {alias}.id) < (%s, %s)"
+        params.extend(after)
+    
+    query += f" ORDER BY {alias}.created_at DESC, {alias}.id DESC"
+    
+    if limit is not None:
+        # Fetch one extra row to know whether another page exists
+        query += " LIMIT %s"
+        params.append(limit + 1)
+    
+    return query, params
+
+def parse_date_arg(name):
+    """Parse an optional YYYY-MM-DD query parameter, raising ValueError if it is malformed"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a YYYY-MM-DD date')
+
+def estimate_count(cursor, query, params):
+    """Return the planner's row estimate for a query without executing it"""
+    explain_cursor = cursor.connection.cursor()
+    explain_cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = explain_cursor.fetchone()[0]
+    explain_cursor.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def split_page(rows, limit):
+    """Trim the look-ahead row and return (rows, next_cursor)"""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+@app.route('/', methods=['GET'])
+def get_root():
+    return jsonify({'message': 'Welcome to the Annvahak API!'}), 200
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def get_metrics():
+    """Connection pool gauges for this worker, in Prometheus text format"""
+    pools = {'sync': db_pool.stats(), 'async': async_db_pool.stats()}
+    metrics = [
+        ('db_pool_connections_in_use', 'gauge', 'in_use', 'Connections checked out'),
+        ('db_pool_connections_idle', 'gauge', 'idle', 'Open connections waiting in the pool'),
+        ('db_pool_waiting', 'gauge', 'waiting', 'Callers waiting for a free connection'),
+        ('db_pool_connections_max', 'gauge', 'max', 'Maximum pool size'),
+        ('db_pool_checkouts_total', 'counter', 'checkouts', 'Connections handed out'),
+        ('db_pool_timeouts_total', 'counter', 'timeouts', 'Checkouts that gave up waiting'),
+        ('db_pool_wait_seconds_total', 'counter', 'wait_seconds', 'Time spent waiting for connections'),
+    ]
+    
+    pid = os.getpid()
+    lines = []
+    for name, metric_type, field, description in metrics:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for pool_name, stats in pools.items():
+            lines.append(f'{name}{{pool="{pool_name}",pid="{pid}"}} {stats[field]}')
+    
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# Password Hashing
+class PasswordHasherBusy(Exception):
+    """Raised when the password hashing queue is full"""
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool.
+
+    At most `workers` hashes run at once, so a burst of sign-ins cannot take
+    every CPU from other requests, and at most `queue_size` more may wait.
+    Beyond that PasswordHasherBusy is raised rather than queueing without bound.
+    """
+    
+    def __init__(self, workers, queue_size, rounds):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.rounds = rounds
+    
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+    
+    def hash(self, password):
+        salt = bcrypt.gensalt(self.rounds)
+        return self.run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+    
+    def check(self, password, hashed):
+        return self.run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+    
+    def needs_rehash(self, hashed):
+        """True when a hash was made with a lower work factor than configured"""
+        try:
+            return int(hashed.split('$')[2]) < self.rounds
+        except (IndexError, ValueError):
+            return False
+
+password_hasher = PasswordHasher(
+    app.config['PASSWORD_HASH_WORKERS'],
+    app.config['PASSWORD_HASH_QUEUE_SIZE'],
+    app.config['BCRYPT_ROUNDS']
+)
+
+def password_hasher_busy_response():
+    response = jsonify({'message': 'Too many sign-in requests right now. Please try again shortly.'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def upgrade_password_hash(user_id, old_hash, password):
+    """Re-hash a password at the current work factor after a successful login"""
+    # Hash before checking out a connection, so none is held through bcrypt
+    try:
+        new_hash = password_hasher.hash(password)
+    except Exception as e:
+        # The old hash still works, so the login goes ahead and a later one retries
+        print(f"Password rehash failed for user {user_id}: {repr(e)}")
+        return
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # Skip if the password changed since it was read
+        cursor.execute(
+            "UPDATE users SET password = %s WHERE id = %s AND password = %s",
+            (new_hash, user_id, old_hash)
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Password rehash failed for user {user_id}: {repr(e)}")
+    finally:
+        cursor.close()
+    
+    release_db_connection()
 
 # Authentication Routes
 @app.route('/api/auth/register', methods=['POST'])
@@ -234,12 +1561,20 @@ def register():
                   (data['username'], data['email']))
     existing_user = cursor.fetchone()
     
+    cursor.close()
+    
     if existing_user:
-        cursor.close()
         return jsonify({'message': 'Username or email already exists!'}), 409
     
-    # Hash the password
-    hashed_password = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    # Don't hold a pooled connection while hashing
+    release_db_connection()
+    try:
+        hashed_password = password_hasher.hash(data['password'])
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+    
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     # Insert new user
     try:
@@ -289,6 +1624,8 @@ def login():
     cursor.execute("SELECT * FROM users WHERE username = %s", (data['username'],))
     user = cursor.fetchone()
     cursor.close()
+    # Don't hold a pooled connection while checking the password
+    release_db_connection()
     
     if not user:
         return jsonify({'message': 'Invalid username or password!'}), 401
@@ -298,7 +1635,15 @@ def login():
         return jsonify({'message': 'Your account has been deactivated. Please contact support.'}), 403
     
     # Verify password
-    if bcrypt.checkpw(data['password'].encode('utf-8'), user['password'].encode('utf-8')):
+    try:
+        password_ok = password_hasher.check(data['password'], user['password'])
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+    
+    if password_ok:
+        if password_hasher.needs_rehash(user['password']):
+            upgrade_password_hash(user['id'], user['password'], data['password'])
+        
         # Generate JWT token
         token = generate_jwt(user['id'], user['role'])
         
@@ -320,7 +1665,7 @@ def login():
 @token_required
 def get_profile(current_user):
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     cursor.execute("SELECT id, username, email, role, full_name, phone, address, is_active, is_verified, created_at FROM users WHERE id = %s", 
                   (current_user['id'],))
@@ -330,12 +1675,8 @@ def get_profile(current_user):
     if not user:
         return jsonify({'message': 'User not found!'}), 404
     
-    # Convert to dictionary for JSON serialization
-    user_dict = dict(user)
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
-    
     return jsonify({
-        'user': user_dict
+        'user': user
     }), 200
 
 @app.route('/api/auth/profile', methods=['PUT'])
@@ -343,9 +1684,6 @@ def get_profile(current_user):
 def update_profile(current_user):
     data = request.get_json()
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # Fields that are allowed to be updated
     allowed_fields = ['full_name', 'phone', 'address']
     update_data = {k: v for k, v in data.items() if k in allowed_fields}
@@ -353,6 +1691,9 @@ def update_profile(current_user):
     if not update_data:
         return jsonify({'message': 'No valid fields to update!'}), 400
     
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
     try:
         # Construct update query dynamically
         query = "UPDATE users SET " + ", ".join([f"{key} = %s" for key in update_data.keys()]) + ", updated_at = CURRENT_TIMESTAMP WHERE id = %s"
@@ -360,6 +1701,9 @@ def update_profile(current_user):
         
         cursor.execute(query, values)
         conn.commit()
+        if current_user['role'] == 'farmer':
+            # Product responses embed the farmer's name and phone
+            invalidate_product_cache()
         
         if cursor.rowcount == 0:
             return jsonify({'message': 'User not found!'}), 404
@@ -386,24 +1730,42 @@ def change_password(current_user):
     
     try:
         # Get user with password
-        cursor.execute("SELECT * FROM users WHERE id = %s", (current_user['id'],))
+        cursor.execute("SELECT password FROM users WHERE id = %s", (current_user['id'],))
         user = cursor.fetchone()
-        
-        if not user:
-            return jsonify({'message': 'User not found!'}), 404
-        
+    except Exception as e:
+        print(f"Password change error: {str(e)}")
+        return jsonify({'message': f'Error updating password: {str(e)}'}), 500
+    finally:
+        cursor.close()
+    
+    # Don't hold a pooled connection while checking and hashing passwords
+    release_db_connection()
+    
+    if not user:
+        return jsonify({'message': 'User not found!'}), 404
+    
+    try:
         # Verify current password
-        if not bcrypt.checkpw(data['current_password'].encode('utf-8'), user['password'].encode('utf-8')):
+        if not password_hasher.check(data['current_password'], user['password']):
             return jsonify({'message': 'Current password is incorrect!'}), 401
         
         # Hash the new password
-        hashed_password = bcrypt.hashpw(data['new_password'].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        
-        # Update the password
+        hashed_password = password_hasher.hash(data['new_password'])
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        # Update the password, unless it changed while we were hashing
         cursor.execute(
-            "UPDATE users SET password = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-            (hashed_password, current_user['id'])
+            "UPDATE users SET password = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND password = %s",
+            (hashed_password, current_user['id'], user['password'])
         )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return jsonify({'message': 'Password was changed by another request. Please try again.'}), 409
         conn.commit()
         
         return jsonify({'message': 'Password updated successfully!'}), 200
@@ -417,17 +1779,31 @@ def change_password(current_user):
 
 # Product Routes
 @app.route('/api/products', methods=['GET'])
+@cached_response(product_list_cache_key)
+@conditional_response(['products', 'user_labels'])
 def get_products():
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
     # Get query parameters for filtering
     category = request.args.get('category')
     search = request.args.get('search')
     farmer_id = request.args.get('farmer_id')
     
+    try:
+        limit, after = get_page_args()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # Search results are ranked by relevance, so a (created_at, id) cursor does not apply
+    if search and after:
+        return jsonify({'message': 'Cursor pagination is not supported with search'}), 400
+    
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    
     # Base query - only return approved and available products by default
-    query = "SELECT p.*, u.full_name as farmer_name FROM products p JOIN users u ON p.farmer_id = u.id WHERE p.is_approved = true AND p.is_available = true"
+    query = "SELECT p.*, u.full_name as farmer_name FROM products p JOIN users u ON p.farmer_id = u.id"
+    if search:
+        query += " JOIN product_search ps ON ps.product_id = p.id"
+    query += " WHERE p.is_approved = true AND p.is_available = true"
     params = []
     
     # Add filters if provided
@@ -436,75 +1812,105 @@ def get_products():
         params.append(category)
     
     if search:
-        query += " AND (p.name ILIKE %s OR p.description ILIKE %s)"
-        search_term = f"%{search}%"
-        params.extend([search_term, search_term])
+        trgm_enabled = app.config['SEARCH_TRGM_ENABLED']
+        tsquery = f"websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', %s)"
+        
+        # Full-text match, or a fuzzy match on the name to tolerate typos
+        query += f" AND (ps.document @@ {tsquery}"
+        params.append(search)
+        if trgm_enabled:
+            query += " OR %s <%% ps.name"
+            params.append(search)
+        query += ")"
     
     if farmer_id:
         query += " AND p.farmer_id = %s"
         params.append(farmer_id)
     
-    query += " ORDER BY p.created_at DESC"
-    
-    cursor.execute(query, params)
-    products = cursor.fetchall()
+    if search:
+        rank = f"ts_rank(ps.document, {tsquery})"
+        params.append(search)
+        if trgm_enabled:
+            rank += " + word_similarity(%s, ps.name)"
+            params.append(search)
+        query += f" ORDER BY {rank} DESC, p.created_at DESC, p.id DESC"
+        
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        
+        cursor.execute(query, params)
+        products, next_cursor = cursor.fetchall(), None
+    else:
+        query, params = apply_keyset_page(query, params, limit, after, 'p')
+        
+        cursor.execute(query, params)
+        products, next_cursor = split_page(cursor.fetchall(), limit)
     cursor.close()
+    release_db_connection()
     
-    # Convert to list of dictionaries for JSON serialization
-    products_list = []
-    for product in products:
-        product_dict = dict(product)
-        product_dict['created_at'] = product_dict['created_at'].isoformat()
-        product_dict['updated_at'] = product_dict['updated_at'].isoformat()
-        products_list.append(product_dict)
+    response = {'products': products}
+    if limit is not None:
+        response['next_cursor'] = next_cursor
     
-    return jsonify({'products': products_list}), 200
+    return jsonify(response), 200
 
 @app.route('/api/products/all', methods=['GET'])
 @token_required
 @role_required(['admin'])
 def get_all_products(current_user):
+    try:
+        limit, after = get_page_args()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
-    cursor.execute(
+    query, params = apply_keyset_page(
         '''SELECT p.*, u.full_name as farmer_name FROM products p 
            JOIN users u ON p.farmer_id = u.id 
-           ORDER BY p.created_at DESC'''
+           WHERE 1=1''',
+        [], limit, after, 'p'
     )
-    products = cursor.fetchall()
+    cursor.execute(query, params)
+    products, next_cursor = split_page(cursor.fetchall(), limit)
     cursor.close()
+    release_db_connection()
     
-    # Convert to list of dictionaries for JSON serialization
-    products_list = []
-    for product in products:
-        product_dict = dict(product)
-        product_dict['created_at'] = product_dict['created_at'].isoformat()
-        product_dict['updated_at'] = product_dict['updated_at'].isoformat()
-        products_list.append(product_dict)
+    response = {'products': products}
+    if limit is not None:
+        response['next_cursor'] = next_cursor
     
-    return jsonify({'products': products_list}), 200
+    return jsonify(response), 200
 
 @app.route('/api/products/farmer', methods=['GET'])
 @token_required
 @role_required(['farmer'])
+@conditional_response(['products'])
 def get_farmer_products(current_user):
+    try:
+        limit, after = get_page_args()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
-    cursor.execute("SELECT * FROM products WHERE farmer_id = %s ORDER BY created_at DESC", (current_user['id'],))
-    products = cursor.fetchall()
+    query, params = apply_keyset_page(
+        "SELECT p.* FROM products p WHERE p.farmer_id = %s",
+        [current_user['id']], limit, after, 'p'
+    )
+    cursor.execute(query, params)
+    products, next_cursor = split_page(cursor.fetchall(), limit)
     cursor.close()
+    release_db_connection()
     
-    # Convert to list of dictionaries for JSON serialization
-    products_list = []
-    for product in products:
-        product_dict = dict(product)
-        product_dict['created_at'] = product_dict['created_at'].isoformat()
-        product_dict['updated_at'] = product_dict['updated_at'].isoformat()
-        products_list.append(product_dict)
+    response = {'products': products}
+    if limit is not None:
+        response['next_cursor'] = next_cursor
     
-    return jsonify({'products': products_list}), 200
+    return jsonify(response), 200
 
 @app.route('/api/products', methods=['POST'])
 @token_required
@@ -519,7 +1925,7 @@ def create_product(current_user):
             return jsonify({'message': f'Missing required field: {field}'}), 400
     
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     try:
         cursor.execute(
@@ -528,20 +1934,17 @@ def create_product(current_user):
             (data['name'], data['description'], data['category'], data['price'], 
              data['quantity'], data['unit'], data.get('image_url', ''), current_user['id'])
         )
-        product_id = cursor.fetchone()[0]
+        product_id = cursor.fetchone()['id']
         conn.commit()
+        invalidate_product_cache([product_id])
         
         # Get the newly created product
         cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
         product = cursor.fetchone()
         
-        product_dict = dict(product)
-        product_dict['created_at'] = product_dict['created_at'].isoformat()
-        product_dict['updated_at'] = product_dict['updated_at'].isoformat()
-        
         return jsonify({
             'message': 'Product created successfully! Waiting for admin approval.',
-            'product': product_dict
+            'product': product
         }), 201
     
     except Exception as e:
@@ -551,9 +1954,11 @@ def create_product(current_user):
         cursor.close()
 
 @app.route('/api/products/<int:product_id>', methods=['GET'])
+@cached_response(product_detail_cache_key)
+@conditional_response(['products', 'user_labels'])
 def get_product(product_id):
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     cursor.execute(
         '''SELECT p.*, u.full_name as farmer_name, u.phone as farmer_phone 
@@ -563,39 +1968,18 @@ def get_product(product_id):
     )
     product = cursor.fetchone()
     cursor.close()
+    release_db_connection()
     
     if not product:
         return jsonify({'message': 'Product not found!'}), 404
     
-    # Convert to dictionary for JSON serialization
-    product_dict = dict(product)
-    product_dict['created_at'] = product_dict['created_at'].isoformat()
-    product_dict['updated_at'] = product_dict['updated_at'].isoformat()
-    
-    return jsonify({'product': product_dict}), 200
+    return jsonify({'product': product}), 200
 
 @app.route('/api/products/<int:product_id>', methods=['PUT'])
 @token_required
 def update_product(current_user, product_id):
-    # First check if the product exists and belongs to the user
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-    product = cursor.fetchone()
-    
-    if not product:
-        cursor.close()
-        return jsonify({'message': 'Product not found!'}), 404
-    
-    # Check permissions: farmer can only edit their own products, admin can edit any
-    if current_user['role'] == 'farmer' and product['farmer_id'] != current_user['id']:
-        cursor.close()
-        return jsonify({'message': 'You do not have permission to edit this product!'}), 403
-    
     # Only admin and farmer roles can update products
     if current_user['role'] not in ['admin', 'farmer']:
-        cursor.close()
         return jsonify({'message': 'Permission denied!'}), 403
     
     data = request.get_json()
@@ -609,36 +1993,45 @@ def update_product(current_user, product_id):
     update_data = {k: v for k, v in data.items() if k in allowed_fields}
     
     if not update_data:
-        cursor.close()
         return jsonify({'message': 'No valid fields to update!'}), 400
     
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    
     try:
+        # First check if the product exists and belongs to the user
+        cursor.execute("SELECT farmer_id FROM products WHERE id = %s", (product_id,))
+        product = cursor.fetchone()
+        
+        if not product:
+            return jsonify({'message': 'Product not found!'}), 404
+        
+        # Check permissions: farmer can only edit their own products, admin can edit any
+        if current_user['role'] == 'farmer' and product['farmer_id'] != current_user['id']:
+            return jsonify({'message': 'You do not have permission to edit this product!'}), 403
+        
         # Construct update query dynamically
         query = "UPDATE products SET " + ", ".join([f"{key} = %s" for key in update_data.keys()]) 
-        query += ", updated_at = CURRENT_TIMESTAMP WHERE id = %s"
+        query += ", updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING *"
         values = list(update_data.values()) + [product_id]
         
         cursor.execute(query, values)
-        conn.commit()
-        
-        # Get the updated product
-        cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
         updated_product = cursor.fetchone()
-        
-        product_dict = dict(updated_product)
-        product_dict['created_at'] = product_dict['created_at'].isoformat()
-        product_dict['updated_at'] = product_dict['updated_at'].isoformat()
-        
-        return jsonify({
-            'message': 'Product updated successfully!',
-            'product': product_dict
-        }), 200
+        conn.commit()
     
     except Exception as e:
         conn.rollback()
         return jsonify({'message': f'Error updating product: {str(e)}'}), 500
     finally:
         cursor.close()
+    
+    release_db_connection()
+    invalidate_product_cache([product_id])
+    
+    return jsonify({
+        'message': 'Product updated successfully!',
+        'product': updated_product
+    }), 200
 
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
 @token_required
@@ -667,6 +2060,7 @@ def delete_product(current_user, product_id):
     try:
         cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
         conn.commit()
+        invalidate_product_cache([product_id])
         
         if cursor.rowcount == 0:
             return jsonify({'message': 'Product not found!'}), 404
@@ -692,6 +2086,7 @@ def approve_product(current_user, product_id):
             (product_id,)
         )
         conn.commit()
+        invalidate_product_cache([product_id])
         
         if cursor.rowcount == 0:
             return jsonify({'message': 'Product not found!'}), 404
@@ -704,6 +2099,54 @@ def approve_product(current_user, product_id):
     finally:
         cursor.close()
 
+# Order Helpers
+def fetch_order_items(conn, order_ids):
+    """Load the items of many orders in a single query, grouped by order id"""
+    items_by_order = {}
+    if not order_ids:
+        return items_by_order
+    
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute(
+        '''SELECT oi.*, p.name as product_name, p.image_url, u.full_name as farmer_name 
+           FROM order_items oi 
+           JOIN products p ON oi.product_id = p.id 
+           JOIN users u ON oi.farmer_id = u.id 
+           WHERE oi.order_id = ANY(%s)
+           ORDER BY oi.order_id, oi.id''',
+        (list(order_ids),)
+    )
+    
+    for item in cursor.fetchall():
+        items_by_order.setdefault(item['order_id'], []).append(item)
+    cursor.close()
+    
+    return items_by_order
+
+def find_idempotent_order(cursor, buyer_id, idempotency_key):
+    """Return the order a buyer already placed with this Idempotency-Key, if any"""
+    cursor.execute(
+        '''SELECT id, order_number, total_amount FROM orders 
+           WHERE buyer_id = %s AND idempotency_key = %s''',
+        (buyer_id, idempotency_key)
+    )
+    return cursor.fetchone()
+
+def order_placed_response(order_id, order_number, total_amount, replayed=False):
+    """Build the create_order response, identical for first attempts and retries"""
+    response = jsonify({
+        'message': 'Order placed successfully!',
+        'order': {
+            'id': order_id,
+            'order_number': order_number,
+            'total_amount': total_amount,
+            'status': 'pending'
+        }
+    })
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response, 201
+
 # Order Routes
 @app.route('/api/orders', methods=['POST'])
 @token_required
@@ -721,35 +2164,69 @@ def create_order(current_user):
     if not isinstance(data['items'], list) or len(data['items']) == 0:
         return jsonify({'message': 'Items must be a non-empty array!'}), 400
     
+    # Optional client-generated key that makes retries of this request safe
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+        return jsonify({'message': 'Idempotency-Key must be 1 to 255 characters!'}), 400
+    
+    # Total quantity requested per product, since a cart may repeat a product
+    requested = {}
     for item in data['items']:
-        if not all(k in item for k in ('product_id', 'quantity')):
+        if not isinstance(item, dict) or not all(k in item for k in ('product_id', 'quantity')):
             return jsonify({'message': 'Each item must contain product_id and quantity!'}), 400
+        
+        try:
+            item['product_id'] = int(item['product_id'])
+            item['quantity'] = int(item['quantity'])
+        except (ValueError, TypeError):
+            return jsonify({'message': 'product_id and quantity must be integers!'}), 400
+        
+        if item['quantity'] < 1:
+            return jsonify({'message': 'Quantity must be at least 1!'}), 400
+        
+        requested[item['product_id']] = requested.get(item['product_id'], 0) + item['quantity']
     
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     try:
-        # First verify all products exist, are approved, and have sufficient quantity
-        product_details = []
-        for item in data['items']:
-            cursor.execute(
-                '''SELECT p.*, u.id as farmer_id FROM products p 
-                   JOIN users u ON p.farmer_id = u.id 
-                   WHERE p.id = %s AND p.is_approved = true AND p.is_available = true''', 
-                (item['product_id'],)
-            )
-            product = cursor.fetchone()
+        # A retry of an order that already went through returns the original result
+        if idempotency_key:
+            existing = find_idempotent_order(cursor, current_user['id'], idempotency_key)
+            if existing:
+                conn.rollback()
+                return order_placed_response(existing['id'], existing['order_number'],
+                                             float(existing['total_amount']), replayed=True)
+        
+        # Load and lock every product in the cart at once. Locking in id order
+        # means concurrent checkouts of overlapping carts cannot deadlock, and
+        # holding the locks means two buyers cannot both take the last units.
+        cursor.execute(
+            '''SELECT p.* FROM products p 
+               WHERE p.id = ANY(%s) AND p.is_approved = true AND p.is_available = true 
+               ORDER BY p.id 
+               FOR UPDATE''',
+            (sorted(requested),)
+        )
+        products = {product['id']: product for product in cursor.fetchall()}
+        
+        # Verify all products exist, are approved, and have sufficient quantity
+        for product_id, quantity in requested.items():
+            product = products.get(product_id)
             
             if not product:
                 conn.rollback()
-                return jsonify({'message': f'Product with ID {item["product_id"]} not found or not available!'}), 404
+                return jsonify({'message': f'Product with ID {product_id} not found or not available!'}), 404
             
-            if product['quantity'] < item['quantity']:
+            if product['quantity'] < quantity:
                 conn.rollback()
                 return jsonify({'message': f'Insufficient quantity for product {product["name"]}!'}), 400
-            
+        
+        product_details = []
+        for item in data['items']:
+            product = products[item['product_id']]
             product_details.append({
-                'product': dict(product),
+                'product': product,
                 'quantity': item['quantity'],
                 'total_price': float(product['price']) * item['quantity']
             })
@@ -757,46 +2234,60 @@ def create_order(current_user):
         # Calculate total order amount
         total_amount = sum(item['total_price'] for item in product_details)
         
-        # Generate a unique order number
-        order_number = f"ORD-{int(time.time())}-{current_user['id']}"
+        # Create the order, numbered from a sequence so numbers never collide;
+        # lpad truncates longer strings, so pad only up to the number's own length
+        try:
+            cursor.execute(
+                '''INSERT INTO orders (order_number, buyer_id, total_amount, delivery_address, contact_number, idempotency_key) 
+                   SELECT 'ORD-' || to_char(CURRENT_DATE, 'YYYYMMDD') || '-' || lpad(seq.n, greatest(6, length(seq.n)), '0'), 
+                          %s, %s, %s, %s, %s 
+                   FROM (SELECT nextval('order_number_seq')::text AS n) seq 
+                   RETURNING id, order_number''',
+                (current_user['id'], total_amount, data['delivery_address'], data['contact_number'], idempotency_key)
+            )
+        except psycopg2.errors.UniqueViolation:
+            # A concurrent retry with the same key committed first
+            conn.rollback()
+            existing = find_idempotent_order(cursor, current_user['id'], idempotency_key)
+            if not existing:
+                raise
+            conn.rollback()
+            return order_placed_response(existing['id'], existing['order_number'],
+                                         float(existing['total_amount']), replayed=True)
+        
+        order_id, order_number = cursor.fetchone()
         
-        # Create the order
-        cursor.execute(
-            '''INSERT INTO orders (order_number, buyer_id, total_amount, delivery_address, contact_number) 
-               VALUES (%s, %s, %s, %s, %s) RETURNING id''',
-            (order_number, current_user['id'], total_amount, data['delivery_address'], data['contact_number'])
+        # Create all order items in one statement
+        psycopg2.extras.execute_values(
+            cursor,
+            '''INSERT INTO order_items 
+               (order_id, product_id, farmer_id, quantity, price_per_unit, total_price) 
+               VALUES %s''',
+            [(order_id, item['product']['id'], item['product']['farmer_id'], item['quantity'],
+              item['product']['price'], item['total_price']) for item in product_details]
         )
-        order_id = cursor.fetchone()[0]
         
-        # Create order items and update product quantities
-        for item in product_details:
-            product = item['product']
-            quantity = item['quantity']
-            
-            cursor.execute(
-                '''INSERT INTO order_items 
-                   (order_id, product_id, farmer_id, quantity, price_per_unit, total_price) 
-                   VALUES (%s, %s, %s, %s, %s, %s)''',
-                (order_id, product['id'], product['farmer_id'], quantity, product['price'], item['total_price'])
-            )
-            
-            # Update product quantity
-            cursor.execute(
-                "UPDATE products SET quantity = quantity - %s WHERE id = %s",
-                (quantity, product['id'])
-            )
+        # Decrement stock for every product in one statement. The quantity guard
+        # keeps stock from going negative even if a row escaped the lock above.
+        updated = psycopg2.extras.execute_values(
+            cursor,
+            '''UPDATE products p SET quantity = p.quantity - v.quantity 
+               FROM (VALUES %s) AS v(id, quantity) 
+               WHERE p.id = v.id AND p.quantity >= v.quantity 
+               RETURNING p.id''',
+            list(requested.items()),
+            fetch=True
+        )
+        
+        if len(updated) != len(requested):
+            conn.rollback()
+            return jsonify({'message': 'Stock changed while placing the order, please try again!'}), 409
         
         conn.commit()
+        # Stock levels changed
+        invalidate_product_cache(list(requested))
         
-        return jsonify({
-            'message': 'Order placed successfully!',
-            'order': {
-                'id': order_id,
-                'order_number': order_number,
-                'total_amount': total_amount,
-                'status': 'pending'
-            }
-        }), 201
+        return order_placed_response(order_id, order_number, total_amount)
     
     except Exception as e:
         conn.rollback()
@@ -807,56 +2298,48 @@ def create_order(current_user):
 @app.route('/api/orders/buyer', methods=['GET'])
 @token_required
 @role_required(['buyer'])
+@conditional_response(order_etag_scopes)
 def get_buyer_orders(current_user):
+    try:
+        limit, after = get_page_args()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     try:
-        # Get all orders for the buyer
-        cursor.execute(
-            '''SELECT * FROM orders WHERE buyer_id = %s ORDER BY created_at DESC''',
-            (current_user['id'],)
+        # Get a page of orders for the buyer
+        query, params = apply_keyset_page(
+            "SELECT o.* FROM orders o WHERE o.buyer_id = %s",
+            [current_user['id']], limit, after, 'o'
         )
-        orders = cursor.fetchall()
-        
-        orders_list = []
-        for order in orders:
-            # Get order items for each order
-            cursor.execute(
-                '''SELECT oi.*, p.name as product_name, p.image_url, u.full_name as farmer_name 
-                   FROM order_items oi 
-                   JOIN products p ON oi.product_id = p.id 
-                   JOIN users u ON oi.farmer_id = u.id 
-                   WHERE oi.order_id = %s''',
-                (order['id'],)
-            )
-            items = cursor.fetchall()
-            
-            # Convert order to dictionary
-            order_dict = dict(order)
-            order_dict['created_at'] = order_dict['created_at'].isoformat()
-            order_dict['updated_at'] = order_dict['updated_at'].isoformat()
-            
-            # Convert items to list of dictionaries
-            items_list = []
-            for item in items:
-                item_dict = dict(item)
-                item_dict['created_at'] = item_dict['created_at'].isoformat()
-                items_list.append(item_dict)
-            
-            order_dict['items'] = items_list
-            orders_list.append(order_dict)
+        cursor.execute(query, params)
+        orders, next_cursor = split_page(cursor.fetchall(), limit)
         
-        return jsonify({'orders': orders_list}), 200
+        # Get the items of every order on the page in one query
+        items_by_order = fetch_order_items(conn, [order['id'] for order in orders])
     
     except Exception as e:
         return jsonify({'message': f'Error fetching orders: {str(e)}'}), 500
     finally:
         cursor.close()
+    
+    release_db_connection()
+    
+    for order in orders:
+        order['items'] = items_by_order.get(order['id'], [])
+    
+    response = {'orders': orders}
+    if limit is not None:
+        response['next_cursor'] = next_cursor
+    
+    return jsonify(response), 200
 
 @app.route('/api/orders/farmer', methods=['GET'])
 @token_required
 @role_required(['farmer'])
+@conditional_response(order_etag_scopes)
 def get_farmer_orders(current_user):
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -890,7 +2373,7 @@ def get_farmer_orders(current_user):
                     'buyer_id': item['buyer_id'],
                     'delivery_address': item['delivery_address'],
                     'contact_number': item['contact_number'],
-                    'order_date': item['order_date'].isoformat(),
+                    'order_date': item['order_date'],
                     'items': []
                 }
             
@@ -904,7 +2387,7 @@ def get_farmer_orders(current_user):
                 'price_per_unit': float(item['price_per_unit']),
                 'total_price': float(item['total_price']),
                 'status': item['status'],
-                'created_at': item['created_at'].isoformat()
+                'created_at': item['created_at']
             }
             
             orders_map[order_id]['items'].append(item_dict)
@@ -922,59 +2405,83 @@ def get_farmer_orders(current_user):
 @app.route('/api/orders', methods=['GET'])
 @token_required
 @role_required(['admin'])
+@conditional_response(order_etag_scopes)
 def get_all_orders(current_user):
+    status = request.args.get('status')
+    buyer_id = request.args.get('buyer_id')
+    
+    if status and status not in ['pending', 'accepted', 'rejected', 'completed']:
+        return jsonify({'message': 'Invalid status value!'}), 400
+    
+    try:
+        limit, after = get_page_args()
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+        if buyer_id is not None:
+            buyer_id = int(buyer_id)
+    except ValueError as e:
+        return jsonify({'message': f'Invalid filter: {str(e)}'}), 400
+    
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     try:
-        # Get all orders
-        cursor.execute(
-            '''SELECT o.*, u.full_name as buyer_name FROM orders o 
-               JOIN users u ON o.buyer_id = u.id 
-               ORDER BY o.created_at DESC'''
-        )
-        orders = cursor.fetchall()
+        # Build the filtered order query
+        query = '''SELECT o.*, u.full_name as buyer_name FROM orders o 
+                   JOIN users u ON o.buyer_id = u.id 
+                   WHERE 1=1'''
+        params = []
         
-        orders_list = []
-        for order in orders:
-            # Get order items for each order
-            cursor.execute(
-                '''SELECT oi.*, p.name as product_name, p.image_url, u.full_name as farmer_name 
-                   FROM order_items oi 
-                   JOIN products p ON oi.product_id = p.id 
-                   JOIN users u ON oi.farmer_id = u.id 
-                   WHERE oi.order_id = %s''',
-                (order['id'],)
-            )
-            items = cursor.fetchall()
-            
-            # Convert order to dictionary
-            order_dict = dict(order)
-            order_dict['created_at'] = order_dict['created_at'].isoformat()
-            order_dict['updated_at'] = order_dict['updated_at'].isoformat()
-            
-            # Convert items to list of dictionaries
-            items_list = []
-            for item in items:
-                item_dict = dict(item)
-                item_dict['created_at'] = item_dict['created_at'].isoformat()
-                items_list.append(item_dict)
-            
-            order_dict['items'] = items_list
-            orders_list.append(order_dict)
+        if status:
+            query += " AND o.status = %s"
+            params.append(status)
         
-        return jsonify({'orders': orders_list}), 200
+        if buyer_id is not None:
+            query += " AND o.buyer_id = %s"
+            params.append(buyer_id)
+        
+        if date_from:
+            query += " AND o.created_at >= %s"
+            params.append(date_from)
+        
+        if date_to:
+            # Inclusive of the whole "to" day
+            query += " AND o.created_at < %s"
+            params.append(date_to + datetime.timedelta(days=1))
+        
+        # Planner estimate of the filtered total, instead of a full COUNT(*)
+        total_count = estimate_count(cursor, query, params) if limit is not None else None
+        
+        query, params = apply_keyset_page(query, params, limit, after, 'o')
+        cursor.execute(query, params)
+        orders, next_cursor = split_page(cursor.fetchall(), limit)
+        
+        # Get the items of every order on the page in one query
+        items_by_order = fetch_order_items(conn, [order['id'] for order in orders])
     
     except Exception as e:
         return jsonify({'message': f'Error fetching orders: {str(e)}'}), 500
     finally:
         cursor.close()
+    
+    release_db_connection()
+    
+    for order in orders:
+        order['items'] = items_by_order.get(order['id'], [])
+    
+    response = {'orders': orders}
+    if limit is not None:
+        response['next_cursor'] = next_cursor
+        response['estimated_total'] = total_count
+    
+    return jsonify(response), 200
 
 @app.route('/api/orders/<int:order_id>', methods=['GET'])
 @token_required
+@conditional_response(order_etag_scopes)
 def get_order(current_user, order_id):
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     try:
         # First check if the order exists
@@ -991,10 +2498,10 @@ def get_order(current_user, order_id):
         if current_user['role'] == 'farmer':
             # Check if the farmer has any items in this order
             cursor.execute(
-                "SELECT COUNT(*) FROM order_items WHERE order_id = %s AND farmer_id = %s",
+                "SELECT COUNT(*) as count FROM order_items WHERE order_id = %s AND farmer_id = %s",
                 (order_id, current_user['id'])
             )
-            count = cursor.fetchone()[0]
+            count = cursor.fetchone()['count']
             
             if count == 0:
                 return jsonify({'message': 'You do not have permission to view this order!'}), 403
@@ -1008,32 +2515,9 @@ def get_order(current_user, order_id):
         )
         order = cursor.fetchone()
         
-        # Get order items
-        cursor.execute(
-            '''SELECT oi.*, p.name as product_name, p.image_url, u.full_name as farmer_name 
-               FROM order_items oi 
-               JOIN products p ON oi.product_id = p.id 
-               JOIN users u ON oi.farmer_id = u.id 
-               WHERE oi.order_id = %s''',
-            (order_id,)
-        )
-        items = cursor.fetchall()
-        
-        # Convert order to dictionary
-        order_dict = dict(order)
-        order_dict['created_at'] = order_dict['created_at'].isoformat()
-        order_dict['updated_at'] = order_dict['updated_at'].isoformat()
+        order['items'] = fetch_order_items(conn, [order_id]).get(order_id, [])
         
-        # Convert items to list of dictionaries
-        items_list = []
-        for item in items:
-            item_dict = dict(item)
-            item_dict['created_at'] = item_dict['created_at'].isoformat()
-            items_list.append(item_dict)
-        
-        order_dict['items'] = items_list
-        
-        return jsonify({'order': order_dict}), 200
+        return jsonify({'order': order}), 200
     
     except Exception as e:
         return jsonify({'message': f'Error fetching order: {str(e)}'}), 500
@@ -1113,7 +2597,122 @@ def update_order_item_status(current_user, item_id):
     finally:
         cursor.close()
 
+# Chat Streaming
+def notify_chat_message(cursor, chat):
+    """Queue a NOTIFY for a new chat message on the caller's transaction"""
+    payload = json.dumps(chat)
+    if len(payload.encode('utf-8')) > CHAT_NOTIFY_MAX_BYTES:
+        # Too large for NOTIFY; subscribers fetch the text with since_id instead
+        payload = json.dumps(dict(chat, message=None, truncated=True))
+    cursor.execute("SELECT pg_notify(%s, %s)", (CHAT_NOTIFY_CHANNEL, payload))
+
+class ChatBroker:
+    """Fan out chat NOTIFY events to in-process stream subscribers.
+
+    One dedicated LISTEN connection serves every subscriber in the worker, so
+    an open stream costs a small queue rather than a pooled DB connection.
+    """
+    
+    def __init__(self, dsn_config, channel):
+        self.dsn_config = dsn_config
+        self.channel = channel
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.thread = None
+    
+    def subscribe(self, user_id, subscriber=None):
+        """Register a queue that receives messages sent to or by user_id.
+
+        Any object with a put_nowait method can stand in for the queue.
+        """
+        if subscriber is None:
+            subscriber = queue.Queue(maxsize=CHAT_STREAM_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+            # Started lazily so the listener thread lives in the serving process
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.listen, name='chat-broker', daemon=True)
+                self.thread.start()
+        return subscriber
+    
+    def unsubscribe(self, user_id, subscriber):
+        with self.lock:
+            user_subscribers = self.subscribers.get(user_id)
+            if user_subscribers:
+                user_subscribers.discard(subscriber)
+                if not user_subscribers:
+                    del self.subscribers[user_id]
+    
+    def dispatch(self, payload):
+        try:
+            chat = json.loads(payload)
+        except ValueError:
+            print(f"Ignoring malformed chat notification: {payload}")
+            return
+        
+        with self.lock:
+            targets = set()
+            for user_id in (chat.get('receiver_id'), chat.get('sender_id')):
+                targets.update(self.subscribers.get(user_id, ()))
+        
+        for subscriber in targets:
+            try:
+                subscriber.put_nowait(chat)
+            except queue.Full:
+                # Slow client; it can catch up with since_id after reconnecting
+                print(f"Dropping chat {chat.get('id')} for a lagging stream subscriber")
+    
+    def listen(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.dsn_config)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {self.channel}")
+                cursor.close()
+                
+                while True:
+                    if select.select([conn], [], [], CHAT_STREAM_HEARTBEAT_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.dispatch(conn.notifies.pop(0).payload)
+            except psycopg2.Error as e:
+                print(f"Chat broker connection lost, reconnecting: {e}")
+                time.sleep(1)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+chat_broker = ChatBroker(DB_CONFIG, CHAT_NOTIFY_CHANNEL)
+
 # Chat Routes
+@app.route('/api/chats/stream', methods=['GET'])
+@token_required
+def stream_messages(current_user):
+    user_id = current_user['id']
+    subscriber = chat_broker.subscribe(user_id)
+    
+    def generate():
+        try:
+            # Tell the client the stream is live before the first message arrives
+            yield ': connected\n\n'
+            while True:
+                try:
+                    chat = subscriber.get(timeout=CHAT_STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"id: {chat['id']}\nevent: message\ndata: {json.dumps(chat)}\n\n"
+        finally:
+            chat_broker.unsubscribe(user_id, subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/chats/send', methods=['POST'])
 @token_required
 @role_required(['farmer', 'buyer', 'admin'])
@@ -1131,17 +2730,17 @@ def send_message(current_user):
             print(f"Missing required field: {field}")
             return jsonify({'message': f'Missing required field: {field}'}), 400
     
+    # Validate that receiver_id is an integer
+    try:
+        receiver_id = int(data['receiver_id'])
+    except (ValueError, TypeError):
+        print(f"Invalid receiver_id: {data['receiver_id']}")
+        return jsonify({'message': 'Invalid receiver_id - must be an integer'}), 400
+    
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     try:
-        # Validate that receiver_id is an integer
-        try:
-            receiver_id = int(data['receiver_id'])
-        except (ValueError, TypeError):
-            print(f"Invalid receiver_id: {data['receiver_id']}")
-            return jsonify({'message': 'Invalid receiver_id - must be an integer'}), 400
-            
         # First check if receiver exists
         cursor.execute("SELECT id, role FROM users WHERE id = %s", (receiver_id,))
         receiver = cursor.fetchone()
@@ -1162,22 +2761,19 @@ def send_message(current_user):
             (current_user['id'], receiver_id, data['message'])
         )
         result = cursor.fetchone()
-        conn.commit()
         
-        chat_response = {
-            'message': 'Message sent successfully!',
-            'chat': {
-                'id': result['id'],
-                'sender_id': current_user['id'],
-                'receiver_id': receiver_id,
-                'message': data['message'],
-                'is_read': False,
-                'created_at': result['created_at'].isoformat()
-            }
+        chat = {
+            'id': result['id'],
+            'sender_id': current_user['id'],
+            'receiver_id': receiver_id,
+            'message': data['message'],
+            'is_read': False,
+            'created_at': result['created_at'].isoformat()
         }
         
-        print(f"Message sent successfully: {chat_response}")
-        return jsonify(chat_response), 201
+        # Publish to chat streams; NOTIFY is delivered only if the insert commits
+        notify_chat_message(cursor, chat)
+        conn.commit()
     
     except Exception as e:
         conn.rollback()
@@ -1187,12 +2783,33 @@ def send_message(current_user):
         return jsonify({'message': f'Error sending message: {str(e)}'}), 500
     finally:
         cursor.close()
+    
+    release_db_connection()
+    
+    chat_response = {
+        'message': 'Message sent successfully!',
+        'chat': chat
+    }
+    
+    print(f"Message sent successfully: {chat_response}")
+    return jsonify(chat_response), 201
 
 @app.route('/api/chats/<int:user_id>', methods=['GET'])
 @token_required
 def get_conversation(current_user, user_id):
+    try:
+        since_id = get_id_arg('since_id')
+        before_id = get_id_arg('before_id')
+        # Scrolling back always pages; an incremental refresh is unbounded unless asked
+        limit = get_limit_arg(DEFAULT_PAGE_LIMIT if before_id is not None else None)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    if since_id is not None and before_id is not None:
+        return jsonify({'message': 'since_id and before_id cannot be combined'}), 400
+    
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     try:
         # First check if the other user exists
@@ -1202,21 +2819,52 @@ def get_conversation(current_user, user_id):
         if not other_user:
             return jsonify({'message': 'User not found!'}), 404
         
+        # Newest-first when paging back from the end of the thread, oldest-first otherwise
+        direction = 'ASC' if since_id is not None or limit is None else 'DESC'
+        
+        # One index range scan per direction of the conversation, merged afterwards
+        pairs = [(current_user['id'], user_id)]
+        if user_id != current_user['id']:
+            pairs.append((user_id, current_user['id']))
+        
+        branches = []
+        params = []
+        for sender_id, receiver_id in pairs:
+            branch = "SELECT * FROM chats WHERE sender_id = %s AND receiver_id = %s"
+            params.extend([sender_id, receiver_id])
+            if since_id is not None:
+                branch += " AND (created_at, id) > (SELECT created_at, id FROM chats WHERE id = %s)"
+                params.append(since_id)
+            if before_id is not None:
+                branch += " AND (created_at, id) < (SELECT created_at, id FROM chats WHERE id = %s)"
+                params.append(before_id)
+            branch += f" ORDER BY created_at {direction}, id {direction}"
+            if limit is not None:
+                branch += " LIMIT %s"
+                params.append(limit + 1)
+            branches.append(f"({branch})")
+        
         # Get conversation messages (both sent and received)
-        cursor.execute(
-            '''SELECT c.*, 
-                  sender.full_name as sender_name, 
-                  receiver.full_name as receiver_name
-               FROM chats c
-               JOIN users sender ON c.sender_id = sender.id
-               JOIN users receiver ON c.receiver_id = receiver.id
-               WHERE (c.sender_id = %s AND c.receiver_id = %s) 
-                  OR (c.sender_id = %s AND c.receiver_id = %s)
-               ORDER BY c.created_at ASC''',
-            (current_user['id'], user_id, user_id, current_user['id'])
-        )
+        query = f'''SELECT c.*, 
+                      sender.full_name as sender_name, 
+                      receiver.full_name as receiver_name
+                   FROM ({" UNION ALL ".join(branches)}) c
+                   JOIN users sender ON c.sender_id = sender.id
+                   JOIN users receiver ON c.receiver_id = receiver.id
+                   ORDER BY c.created_at {direction}, c.id {direction}'''
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit + 1)
+        
+        cursor.execute(query, params)
         messages = cursor.fetchall()
         
+        has_more = limit is not None and len(messages) > limit
+        if has_more:
+            messages = messages[:limit]
+        if direction == 'DESC':
+            messages.reverse()
+        
         # Mark messages as read if they were sent to the current user
         unread_ids = []
         for message in messages:
@@ -1230,21 +2878,18 @@ def get_conversation(current_user, user_id):
             )
             conn.commit()
         
-        # Convert to list of dictionaries for JSON serialization
-        messages_list = []
-        for message in messages:
-            message_dict = dict(message)
-            message_dict['created_at'] = message_dict['created_at'].isoformat()
-            messages_list.append(message_dict)
-        
-        return jsonify({
+        response = {
             'other_user': {
                 'id': other_user['id'],
                 'role': other_user['role'],
                 'full_name': other_user['full_name']
             },
-            'messages': messages_list
-        }), 200
+            'messages': messages
+        }
+        if limit is not None:
+            response['has_more'] = has_more
+        
+        return jsonify(response), 200
     
     except Exception as e:
         return jsonify({'message': f'Error fetching conversation: {str(e)}'}), 500
@@ -1254,78 +2899,76 @@ def get_conversation(current_user, user_id):
 @app.route('/api/chats/conversations', methods=['GET'])
 @token_required
 def get_conversations(current_user):
+    try:
+        limit, after = get_page_args()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     try:
-        # Get list of users the current user has chatted with
-        cursor.execute(
-            '''SELECT DISTINCT 
-                  CASE 
-                     WHEN sender_id = %s THEN receiver_id 
-                     ELSE sender_id 
-                  END as user_id
-               FROM chats
-               WHERE sender_id = %s OR receiver_id = %s''',
-            (current_user['id'], current_user['id'], current_user['id'])
-        )
-        user_ids = [row['user_id'] for row in cursor.fetchall()]
-        
-        if not user_ids:
-            return jsonify({'conversations': []}), 200
-        
-        conversations = []
-        for user_id in user_ids:
-            # Get user info
-            cursor.execute(
-                "SELECT id, username, full_name, role FROM users WHERE id = %s",
-                (user_id,)
-            )
-            user = cursor.fetchone()
-            
-            # Get the most recent message
-            cursor.execute(
-                '''SELECT * FROM chats
-                   WHERE (sender_id = %s AND receiver_id = %s) 
-                      OR (sender_id = %s AND receiver_id = %s)
-                   ORDER BY created_at DESC
-                   LIMIT 1''',
-                (current_user['id'], user_id, user_id, current_user['id'])
-            )
-            latest_message = cursor.fetchone()
-            
-            # Count unread messages
-            cursor.execute(
-                '''SELECT COUNT(*) FROM chats
-                   WHERE sender_id = %s AND receiver_id = %s AND is_read = false''',
-                (user_id, current_user['id'])
-            )
-            unread_count = cursor.fetchone()[0]
-            
-            conversations.append({
-                'user': {
-                    'id': user['id'],
-                    'username': user['username'],
-                    'full_name': user['full_name'],
-                    'role': user['role']
-                },
-                'latest_message': {
-                    'message': latest_message['message'],
-                    'sender_id': latest_message['sender_id'],
-                    'created_at': latest_message['created_at'].isoformat()
-                },
-                'unread_count': unread_count
-            })
-        
-        # Sort by latest message date
-        conversations.sort(key=lambda x: x['latest_message']['created_at'], reverse=True)
+        # Build the whole inbox in one query: the latest message per partner,
+        # the partner's profile and the unread count from that partner
+        query = '''WITH latest AS (
+                      SELECT DISTINCT ON (partner_id)
+                             partner_id, id, message, sender_id, created_at
+                      FROM (
+                          SELECT c.*,
+                                 CASE WHEN c.sender_id = %s THEN c.receiver_id ELSE c.sender_id END as partner_id
+                          FROM chats c
+                          WHERE c.sender_id = %s OR c.receiver_id = %s
+                      ) mine
+                      ORDER BY partner_id, created_at DESC, id DESC
+                   ),
+                   unread AS (
+                      SELECT sender_id as partner_id, COUNT(*) as unread_count
+                      FROM chats
+                      WHERE receiver_id = %s AND is_read = false
+                      GROUP BY sender_id
+                   )
+                   SELECT l.id, l.message, l.sender_id, l.created_at,
+                          u.id as user_id, u.username, u.full_name, u.role,
+                          COALESCE(un.unread_count, 0) as unread_count
+                   FROM latest l
+                   JOIN users u ON u.id = l.partner_id
+                   LEFT JOIN unread un ON un.partner_id = l.partner_id
+                   WHERE 1=1'''
+        params = [current_user['id']] * 4
         
-        return jsonify({'conversations': conversations}), 200
+        query, params = apply_keyset_page(query, params, limit, after, 'l')
+        cursor.execute(query, params)
+        rows, next_cursor = split_page(cursor.fetchall(), limit)
     
     except Exception as e:
         return jsonify({'message': f'Error fetching conversations: {str(e)}'}), 500
     finally:
         cursor.close()
+    
+    release_db_connection()
+    
+    conversations = []
+    for row in rows:
+        conversations.append({
+            'user': {
+                'id': row['user_id'],
+                'username': row['username'],
+                'full_name': row['full_name'],
+                'role': row['role']
+            },
+            'latest_message': {
+                'message': row['message'],
+                'sender_id': row['sender_id'],
+                'created_at': row['created_at']
+            },
+            'unread_count': row['unread_count']
+        })
+    
+    response = {'conversations': conversations}
+    if limit is not None:
+        response['next_cursor'] = next_cursor
+    
+    return jsonify(response), 200
 
 # User Management Routes (Admin)
 @app.route('/api/admin/users', methods=['GET'])
@@ -1333,7 +2976,7 @@ def get_conversations(current_user):
 @role_required(['admin'])
 def get_all_users(current_user):
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     # Get query parameters for filtering
     role = request.args.get('role')
@@ -1355,15 +2998,7 @@ def get_all_users(current_user):
         cursor.execute(query, params)
         users = cursor.fetchall()
         
-        # Convert to list of dictionaries for JSON serialization
-        users_list = []
-        for user in users:
-            user_dict = dict(user)
-            user_dict['created_at'] = user_dict['created_at'].isoformat()
-            user_dict['updated_at'] = user_dict['updated_at'].isoformat()
-            users_list.append(user_dict)
-        
-        return jsonify({'users': users_list}), 200
+        return jsonify({'users': users}), 200
     
     except Exception as e:
         return jsonify({'message': f'Error fetching users: {str(e)}'}), 500
@@ -1410,6 +3045,7 @@ def update_user_active_status(current_user, user_id):
         
         cursor.execute(query, params)
         conn.commit()
+        token_revocations.refresh(force=True)
         
         return jsonify({'message': 'User status updated successfully!'}), 200
     
@@ -1433,7 +3069,7 @@ def create_admin_user():
         return
     
     # Create admin user
-    admin_password = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    admin_password = password_hasher.hash('admin123')
     
     try:
         cursor.execute(
@@ -1468,7 +3104,7 @@ def add_test_data():
             {
                 'username': 'farmer1',
                 'email': 'farmer1@example.com',
-                'password': bcrypt.hashpw('password123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+                'password': password_hasher.hash('password123'),
                 'role': 'farmer',
                 'full_name': 'Farmer One',
                 'phone': '9876543210',
@@ -1477,7 +3113,7 @@ def add_test_data():
             {
                 'username': 'farmer2',
                 'email': 'farmer2@example.com',
-                'password': bcrypt.hashpw('password123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+                'password': password_hasher.hash('password123'),
                 'role': 'farmer',
                 'full_name': 'Farmer Two',
                 'phone': '9876543211',
@@ -1500,7 +3136,7 @@ def add_test_data():
             {
                 'username': 'buyer1',
                 'email': 'buyer1@example.com',
-                'password': bcrypt.hashpw('password123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+                'password': password_hasher.hash('password123'),
                 'role': 'buyer',
                 'full_name': 'Buyer One',
                 'phone': '9876543212',
@@ -1509,7 +3145,7 @@ def add_test_data():
             {
                 'username': 'buyer2',
                 'email': 'buyer2@example.com',
-                'password': bcrypt.hashpw('password123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+                'password': password_hasher.hash('password123'),
                 'role': 'buyer',
                 'full_name': 'Buyer Two',
                 'phone': '9876543213',
@@ -1623,10 +3259,86 @@ def add_test_data():
     finally:
         cursor.close()
 
-# Initialize admin and test data
-with app.app_context():
-    create_admin_user()
-    add_test_data()
+def benchmark_checkout(clients=20, stock=500, attempts=1000):
+    """Race concurrent one-unit checkouts of a single product and report the outcome.
+
+    Adds a bench farmer, buyer, product and orders, so point it at a scratch
+    database. Requests run in-process against the configured pool.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    suffix = uuid.uuid4().hex[:8]
+    try:
+        user_ids = []
+        for role in ('farmer', 'buyer'):
+            cursor.execute(
+                '''INSERT INTO users (username, email, password, role, full_name) 
+                   VALUES (%s, %s, %s, %s, %s) RETURNING id''',
+                (f'bench_{role}_{suffix}', f'bench_{role}_{suffix}@example.com', '!', role, f'Bench {role}')
+            )
+            user_ids.append(cursor.fetchone()[0])
+        farmer_id, buyer_id = user_ids
+        
+        cursor.execute(
+            '''INSERT INTO products (name, category, price, quantity, unit, farmer_id, is_approved, is_available) 
+               VALUES (%s, %s, %s, %s, %s, %s, true, true) RETURNING id''',
+            (f'Bench product {suffix}', 'Vegetables', 10, stock, 'kg', farmer_id)
+        )
+        product_id = cursor.fetchone()[0]
+        conn.commit()
+    finally:
+        cursor.close()
+    release_db_connection()
+    
+    token = generate_jwt(buyer_id, 'buyer')
+    order = {'items': [{'product_id': product_id, 'quantity': 1}],
+             'delivery_address': 'Bench address', 'contact_number': '0000000000'}
+    statuses = {}
+    statuses_lock = threading.Lock()
+    start = threading.Barrier(clients + 1)
+    
+    def client(count):
+        http = app.test_client()
+        start.wait()
+        for _ in range(count):
+            response = http.post('/api/orders', json=order, headers={'Authorization': f'Bearer {token}'})
+            with statuses_lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    
+    # The bench buyer would otherwise run into the default rate limits
+    limiter.enabled = False
+    threads = [threading.Thread(target=client, args=(attempts // clients + (i < attempts % clients),))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+    limiter.enabled = True
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT quantity FROM products WHERE id = %s", (product_id,))
+        final_stock = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE product_id = %s", (product_id,))
+        units_ordered = cursor.fetchone()[0]
+        conn.rollback()
+    finally:
+        cursor.close()
+    release_db_connection()
+    
+    print(f"{attempts} checkouts from {clients} clients in {elapsed:.2f}s ({attempts / elapsed:.0f} req/s)")
+    print(f"  201 placed: {statuses.get(201, 0)} ({statuses.get(201, 0) / elapsed:.0f} orders/s)")
+    print(f"  400 out of stock: {statuses.get(400, 0)}")
+    print(f"  409 stock changed: {statuses.get(409, 0)} ({statuses.get(409, 0) * 100.0 / attempts:.1f}%)")
+    others = {status: count for status, count in statuses.items() if status not in (201, 400, 409)}
+    if others:
+        print(f"  other: {others}")
+    oversold = final_stock < 0 or units_ordered + final_stock != stock
+    print(f"Stock {stock} -> {final_stock}, units ordered {units_ordered}, oversold: {'YES' if oversold else 'no'}")
 
 # Add a new admin-specific route for product creation with farmer selection
 @app.route('/api/admin/products', methods=['POST'])
@@ -1643,7 +3355,7 @@ def admin_create_product(current_user):
     
     # Validate farmer exists
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     try:
         # Check if farmer exists and has farmer role
@@ -1664,8 +3376,9 @@ def admin_create_product(current_user):
              data['quantity'], data['unit'], data.get('image_url', ''), data['farmer_id'],
              True, data.get('is_available', True))  # Auto-approve products created by admin
         )
-        product_id = cursor.fetchone()[0]
+        product_id = cursor.fetchone()['id']
         conn.commit()
+        invalidate_product_cache([product_id])
         
         # Get the newly created product
         cursor.execute(
@@ -1676,13 +3389,9 @@ def admin_create_product(current_user):
         )
         product = cursor.fetchone()
         
-        product_dict = dict(product)
-        product_dict['created_at'] = product_dict['created_at'].isoformat()
-        product_dict['updated_at'] = product_dict['updated_at'].isoformat()
-        
         return jsonify({
             'message': 'Product created successfully!',
-            'product': product_dict
+            'product': product
         }), 201
     
     except Exception as e:
@@ -1722,6 +3431,7 @@ def update_user_role(current_user, user_id):
             (data['role'], user_id)
         )
         conn.commit()
+        token_revocations.refresh(force=True)
         
         return jsonify({'message': f'User role updated to {data["role"]} successfully!'}), 200
     
@@ -1762,6 +3472,7 @@ def update_user_status(current_user, user_id):
             (is_active, user_id)
         )
         conn.commit()
+        token_revocations.refresh(force=True)
         
         return jsonify({'message': f'User status updated to {data["status"]} successfully!'}), 200
     
@@ -1789,6 +3500,11 @@ def delete_user(current_user, user_id):
         # Delete user
         cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
         conn.commit()
+        # Deleted rows never show up when other workers poll, so their tokens
+        # are only refused here; elsewhere lookups for the user come back empty
+        token_revocations.revoke(user_id)
+        # Deleting a farmer cascades to their products
+        invalidate_product_cache()
         
         return jsonify({'message': 'User deleted successfully!'}), 200
     
@@ -1798,13 +3514,139 @@ def delete_user(current_user, user_id):
     finally:
         cursor.close()
 
+# Admin Export Routes
+EXPORT_QUERIES = {
+    'users': '''SELECT id, username, email, role, full_name, phone, address, 
+                     is_active, is_verified, created_at, updated_at 
+              FROM users ORDER BY id''',
+    'products': '''SELECT p.*, u.full_name as farmer_name FROM products p 
+                 LEFT JOIN users u ON p.farmer_id = u.id 
+                 ORDER BY p.id''',
+    'orders': '''SELECT o.id, o.order_number, o.buyer_id, o.status, o.total_amount, 
+                      o.delivery_address, o.contact_number, o.created_at, o.updated_at, 
+                      u.full_name as buyer_name 
+               FROM orders o LEFT JOIN users u ON o.buyer_id = u.id 
+               ORDER BY o.id''',
+    'order_items': '''SELECT oi.*, p.name as product_name 
+                    FROM order_items oi LEFT JOIN products p ON oi.product_id = p.id 
+                    ORDER BY oi.id''',
+}
+
+def csv_value(value):
+    """Format a column value the same way the JSON responses do"""
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+def format_export_rows(rows, columns, export_format, include_header):
+    """Render one batch of export rows as CSV or NDJSON text"""
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if include_header:
+            writer.writerow(columns)
+        for row in rows:
+            writer.writerow([csv_value(value) for value in row.values()])
+        return buffer.getvalue()
+    return ''.join(app.json.dumps(row) + '\n' for row in rows)
+
+def export_request_error(table, export_format):
+    """Return (message, status) when an export request is invalid"""
+    if table not in EXPORT_QUERIES:
+        return f'Unknown export! Must be one of: {", ".join(EXPORT_QUERIES)}.', 404
+    if export_format not in ['ndjson', 'csv']:
+        return 'Invalid format! Must be ndjson or csv.', 400
+    return None
+
+def export_headers(table, export_format):
+    return {
+        'Content-Type': 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson',
+        'Content-Disposition': f'attachment; filename={table}.{export_format}',
+        'X-Accel-Buffering': 'no'
+    }
+
+export_slots = threading.BoundedSemaphore(app.config['EXPORT_MAX_CONCURRENT'])
+
+def stream_export(cursor, export_format):
+    """Yield an export batch by batch from an executed named (server-side) cursor.
+
+    Only EXPORT_ITERSIZE rows are held in memory at a time.
+    """
+    try:
+        wrote_header = False
+        
+        while True:
+            rows = cursor.fetchmany(EXPORT_ITERSIZE)
+            # A named cursor only has a description after its first fetch
+            columns = [column.name for column in cursor.description]
+            chunk = format_export_rows(rows, columns, export_format, not wrote_header)
+            wrote_header = True
+            
+            if chunk:
+                yield chunk
+            if len(rows) < EXPORT_ITERSIZE:
+                break
+    except Exception as e:
+        # Headers are already sent, so the truncated body is all we can signal
+        print(f"Export failed: {str(e)}")
+
+def close_export(conn, cursor):
+    """Return an export's connection to the pool and free its slot"""
+    try:
+        cursor.close()
+    except psycopg2.Error:
+        # Closing a named cursor fails once its transaction has aborted
+        pass
+    db_pool.putconn(conn)
+    export_slots.release()
+
+@app.route('/api/admin/export/<string:table>', methods=['GET'])
+@token_required
+@role_required(['admin'])
+def export_table(current_user, table):
+    export_format = request.args.get('format', 'ndjson')
+    
+    error = export_request_error(table, export_format)
+    if error:
+        return jsonify({'message': error[0]}), error[1]
+    
+    if not export_slots.acquire(blocking=False):
+        response = jsonify({'message': 'Too many exports are running. Please try again shortly.'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    # The body is streamed after the request context, and g.db_conn, are torn
+    # down, so the export holds its own connection. It is checked out and the
+    # query opened before the response starts, so a busy pool still gets a 503
+    # and a failing query a 500.
+    try:
+        conn = db_pool.getconn()
+    except PoolTimeout:
+        export_slots.release()
+        raise
+    
+    cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.itersize = EXPORT_ITERSIZE
+    try:
+        cursor.execute(EXPORT_QUERIES[table])
+    except Exception as e:
+        close_export(conn, cursor)
+        return jsonify({'message': f'Error exporting {table}: {str(e)}'}), 500
+    
+    response = Response(stream_export(cursor, export_format), headers=export_headers(table, export_format))
+    # Runs even if the client goes away before the body is read
+    response.call_on_close(lambda: close_export(conn, cursor))
+    return response
+
 # Get detailed user information for view button
 @app.route('/api/admin/users/<int:user_id>', methods=['GET'])
 @token_required
 @role_required(['admin'])
 def get_user_details(current_user, user_id):
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     try:
         # Get user details
@@ -1820,32 +3662,27 @@ def get_user_details(current_user, user_id):
             return jsonify({'message': 'User not found!'}), 404
         
         # Add user stats (products if farmer, orders if buyer)
-        user_dict = dict(user)
-        user_dict['created_at'] = user_dict['created_at'].isoformat()
-        user_dict['updated_at'] = user_dict['updated_at'].isoformat()
-        
-        # Get additional stats based on role
         if user['role'] == 'farmer':
             cursor.execute(
-                "SELECT COUNT(*) FROM products WHERE farmer_id = %s",
+                "SELECT COUNT(*) as count FROM products WHERE farmer_id = %s",
                 (user_id,)
             )
-            user_dict['products_count'] = cursor.fetchone()[0]
+            user['products_count'] = cursor.fetchone()['count']
             
             cursor.execute(
-                "SELECT COUNT(*) FROM order_items WHERE farmer_id = %s",
+                "SELECT COUNT(*) as count FROM order_items WHERE farmer_id = %s",
                 (user_id,)
             )
-            user_dict['orders_count'] = cursor.fetchone()[0]
+            user['orders_count'] = cursor.fetchone()['count']
             
         elif user['role'] == 'buyer':
             cursor.execute(
-                "SELECT COUNT(*) FROM orders WHERE buyer_id = %s",
+                "SELECT COUNT(*) as count FROM orders WHERE buyer_id = %s",
                 (user_id,)
             )
-            user_dict['orders_count'] = cursor.fetchone()[0]
+            user['orders_count'] = cursor.fetchone()['count']
         
-        return jsonify({'user': user_dict}), 200
+        return jsonify({'user': user}), 200
     
     except Exception as e:
         return jsonify({'message': f'Error fetching user details: {str(e)}'}), 500
@@ -1853,139 +3690,142 @@ def get_user_details(current_user, user_id):
         cursor.close()
 
 # Reports API Endpoints
+# timeRange -> (rollup table, salesByDate bucket, period start back from today, period length).
+# A period is today plus the days before it, so its start is one day less than its length back.
+SALES_REPORT_RANGES = {
+    'day': ('sales_rollup_hourly', 'hour', '0 days', '1 day'),
+    'week': ('sales_rollup_daily', 'day', '6 days', '7 days'),
+    'month': ('sales_rollup_daily', 'day', '29 days', '30 days'),
+    'year': ('sales_rollup_daily', 'month', '364 days', '365 days'),
+}
+
+TOP_PRODUCTS_LIMIT = 10
+
+# timeRange -> (growth window, bucket, label format); unknown ranges use 'month'.
+# The day window spans yesterday and today, so its hourly labels carry the date.
+USER_GROWTH_RANGES = {
+    'day': ('1 day', 'hour', 'Mon DD HH24:00'),
+    'week': ('7 days', 'day', 'Mon DD'),
+    'month': ('1 month', 'day', 'Mon DD'),
+    'year': ('1 year', 'month', 'Mon DD'),
+}
+
+def report_response(report, build):
+    """Serve a report for the requested timeRange from the report cache"""
+    time_range = request.args.get('timeRange', 'week')
+    # Every unknown range produces the same report, so they share one entry
+    if time_range not in SALES_REPORT_RANGES:
+        time_range = 'other'
+    
+    try:
+        body, state = report_cache.get((report, time_range), lambda: build(time_range))
+    except Exception as e:
+        print(f"Error in {report} report: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'message': f'Error generating report: {str(e)}'}), 500
+    
+    response = app.response_class(body, status=200, mimetype='application/json')
+    response.headers['X-Cache'] = state
+    return response
+
+def percent_change(current, previous):
+    """Relative change from the previous period, rounded to one decimal"""
+    if not previous:
+        return 0.0
+    return round((float(current) - float(previous)) / float(previous) * 100, 1)
+
 @app.route('/api/admin/reports/sales', methods=['GET'])
 @token_required
 @role_required(['admin'])
 def get_sales_reports(current_user):
-    time_range = request.args.get('timeRange', 'week')
+    return report_response('sales', build_sales_report)
+
+def build_sales_report(time_range):
+    # Unknown ranges keep the old behaviour: all-time totals, monthly series for the past year
+    rollup_table, series_unit, period_start, period_length = SALES_REPORT_RANGES.get(time_range, SALES_REPORT_RANGES['year'])
+    series_start = period_start
+    if time_range not in SALES_REPORT_RANGES:
+        period_start = period_length = None
     
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     try:
-        # Initialize data
-        total_sales = 0
-        avg_order_value = 0
-        order_count = 0
-        conversion_rate = 3.2  # This would normally be calculated
+        # Current and previous period metrics in one pass over the rollup;
+        # a NULL period start means all time with no previous period. The
+        # current period is still running, so the previous one is cut off at
+        # the same point, e.g. today so far against yesterday up to this hour.
+        cursor.execute(
+            f"""
+            SELECT 
+                COALESCE(SUM(r.order_count) FILTER (WHERE r.bucket_start >= p.cur_start), 0) as count, 
+                COALESCE(SUM(r.total_amount) FILTER (WHERE r.bucket_start >= p.cur_start), 0) as total,
+                COALESCE(SUM(r.order_count) FILTER (WHERE r.bucket_start >= p.cur_start AND r.status = 'completed'), 0) as completed,
+                COALESCE(SUM(r.order_count) FILTER (WHERE r.bucket_start < p.cur_start), 0) as prev_count, 
+                COALESCE(SUM(r.total_amount) FILTER (WHERE r.bucket_start < p.cur_start), 0) as prev_total,
+                COALESCE(SUM(r.order_count) FILTER (WHERE r.bucket_start < p.cur_start AND r.status = 'completed'), 0) as prev_completed
+            FROM {rollup_table} r,
+                (SELECT 
+                    COALESCE(CURRENT_DATE - %s::interval, '-infinity'::timestamp) as cur_start,
+                    COALESCE(CURRENT_DATE - %s::interval - %s::interval, '-infinity'::timestamp) as prev_start,
+                    COALESCE(LOCALTIMESTAMP - %s::interval, '-infinity'::timestamp) as prev_end) p
+            WHERE r.bucket_start >= p.prev_start
+              AND (r.bucket_start >= p.cur_start OR r.bucket_start < p.prev_end)
+            """,
+            (period_start, period_start, period_length, period_length)
+        )
+        
+        result = cursor.fetchone()
+        order_count = int(result['count'])
+        total_sales = result['total']
+        avg_order_value = total_sales / order_count if order_count > 0 else 0
+        # Share of the period's orders that went on to be completed
+        conversion_rate = round(result['completed'] * 100.0 / order_count, 1) if order_count > 0 else 0.0
+        
+        prev_count = int(result['prev_count'])
+        prev_avg_order_value = result['prev_total'] / prev_count if prev_count > 0 else 0
+        prev_conversion_rate = round(result['prev_completed'] * 100.0 / prev_count, 1) if prev_count > 0 else 0.0
         
-        # Initialize percent changes (simulated)
         percent_changes = {
-            'total': 12.5,
-            'avgOrderValue': 3.2,
-            'orderCount': 8.7,
-            'conversionRate': 0.5
+            'total': percent_change(total_sales, result['prev_total']),
+            'avgOrderValue': percent_change(avg_order_value, prev_avg_order_value),
+            'orderCount': percent_change(order_count, prev_count),
+            # Already a percentage, so report the change in points
+            'conversionRate': round(conversion_rate - prev_conversion_rate, 1) if prev_count > 0 else 0.0
         }
         
-        # Get time period based on time_range
-        date_clause = ""
-        if time_range == 'day':
-            date_clause = "AND o.created_at >= CURRENT_DATE"
-        elif time_range == 'week':
-            date_clause = "AND o.created_at >= CURRENT_DATE - INTERVAL '7 days'"
-        elif time_range == 'month':
-            date_clause = "AND o.created_at >= CURRENT_DATE - INTERVAL '30 days'"
-        elif time_range == 'year':
-            date_clause = "AND o.created_at >= CURRENT_DATE - INTERVAL '365 days'"
-            
-        # Get order metrics
+        # Get sales by date
         cursor.execute(
             f"""
             SELECT 
-                COUNT(*) as count, 
-                COALESCE(SUM(total_amount), 0) as total,
-                COALESCE(AVG(total_amount), 0) as avg
-            FROM orders o
-            WHERE 1=1 {date_clause}
-            """
+                date_trunc(%s, bucket_start) as date,
+                COALESCE(SUM(total_amount), 0) as sales
+            FROM {rollup_table}
+            WHERE bucket_start >= CURRENT_DATE - %s::interval
+            GROUP BY 1
+            HAVING SUM(order_count) > 0
+            ORDER BY 1
+            """,
+            (series_unit, series_start)
         )
         
-        result = cursor.fetchone()
-        if result:
-            order_count = result['count']
-            total_sales = result['total']
-            avg_order_value = result['avg'] if result['count'] > 0 else 0
-            
-        # Get sales by date
-        if time_range == 'day':
-            # Hourly for the current day
-            cursor.execute(
-                """
-                SELECT 
-                    date_trunc('hour', created_at) as date,
-                    COALESCE(SUM(total_amount), 0) as sales
-                FROM orders
-                WHERE created_at >= CURRENT_DATE
-                GROUP BY date_trunc('hour', created_at)
-                ORDER BY date_trunc('hour', created_at)
-                """
-            )
-        elif time_range == 'week':
-            # Daily for the week
-            cursor.execute(
-                """
-                SELECT 
-                    date_trunc('day', created_at) as date,
-                    COALESCE(SUM(total_amount), 0) as sales
-                FROM orders
-                WHERE created_at >= CURRENT_DATE - INTERVAL '7 days'
-                GROUP BY date_trunc('day', created_at)
-                ORDER BY date_trunc('day', created_at)
-                """
-            )
-        elif time_range == 'month':
-            # Daily for the month
-            cursor.execute(
-                """
-                SELECT 
-                    date_trunc('day', created_at) as date,
-                    COALESCE(SUM(total_amount), 0) as sales
-                FROM orders
-                WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
-                GROUP BY date_trunc('day', created_at)
-                ORDER BY date_trunc('day', created_at)
-                """
-            )
-        else:
-            # Monthly for the year
-            cursor.execute(
-                """
-                SELECT 
-                    date_trunc('month', created_at) as date,
-                    COALESCE(SUM(total_amount), 0) as sales
-                FROM orders
-                WHERE created_at >= CURRENT_DATE - INTERVAL '365 days'
-                GROUP BY date_trunc('month', created_at)
-                ORDER BY date_trunc('month', created_at)
-                """
-            )
-            
-        sales_by_date = cursor.fetchall()
         sales_by_date_list = []
-        
-        for item in sales_by_date:
+        for item in cursor.fetchall():
             sales_by_date_list.append({
-                'date': item['date'].isoformat(),
+                'date': item['date'],
                 'sales': float(item['sales'])
             })
-            
-        # Calculate previous period percent changes
-        # For a real application, we would calculate these based on previous periods
         
-        return jsonify({
+        return {
             'totalSales': float(total_sales),
             'avgOrderValue': float(avg_order_value),
             'orderCount': order_count,
             'conversionRate': conversion_rate,
             'percentChanges': percent_changes,
             'salesByDate': sales_by_date_list
-        }), 200
+        }
         
-    except Exception as e:
-        print(f"Error in sales report: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'message': f'Error generating report: {str(e)}'}), 500
     finally:
         cursor.close()
 
@@ -1993,13 +3833,14 @@ def get_sales_reports(current_user):
 @token_required
 @role_required(['admin'])
 def get_product_reports(current_user):
-    time_range = request.args.get('timeRange', 'week')
-    
+    return report_response('products', build_product_report)
+
+def build_product_report(time_range):
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     try:
-        # Get time period based on time_range
+        # Categories count products listed in the period
         date_clause = ""
         if time_range == 'day':
             date_clause = "AND p.created_at >= CURRENT_DATE"
@@ -2009,19 +3850,21 @@ def get_product_reports(current_user):
             date_clause = "AND p.created_at >= CURRENT_DATE - INTERVAL '30 days'"
         elif time_range == 'year':
             date_clause = "AND p.created_at >= CURRENT_DATE - INTERVAL '365 days'"
-            
-        # Get top products (by sales or by quantity)
+        
+        # Top products by units sold in the period, from the daily counters
+        sales_start = SALES_REPORT_RANGES[time_range][2] if time_range in SALES_REPORT_RANGES else None
         cursor.execute(
-            f"""
-            SELECT p.name, COALESCE(SUM(oi.quantity), 0) as sales
-            FROM products p
-            LEFT JOIN order_items oi ON p.id = oi.product_id
-            LEFT JOIN orders o ON oi.order_id = o.id
-            WHERE 1=1 {date_clause}
-            GROUP BY p.name
-            ORDER BY sales DESC
-            LIMIT 10
             """
+            SELECT p.id, p.name, SUM(s.quantity) as sales
+            FROM product_sales_daily s
+            JOIN products p ON p.id = s.product_id
+            WHERE %(start)s::interval IS NULL OR s.day >= CURRENT_DATE - %(start)s::interval
+            GROUP BY p.id, p.name
+            HAVING SUM(s.quantity) > 0
+            ORDER BY sales DESC, p.id
+            LIMIT %(limit)s
+            """,
+            {'start': sales_start, 'limit': TOP_PRODUCTS_LIMIT}
         )
         
         top_products = cursor.fetchall()
@@ -2029,6 +3872,7 @@ def get_product_reports(current_user):
         
         for product in top_products:
             top_products_list.append({
+                'id': product['id'],
                 'name': product['name'],
                 'sales': product['sales']
             })
@@ -2055,16 +3899,11 @@ def get_product_reports(current_user):
                 'count': category['count']
             })
             
-        return jsonify({
+        return {
             'topProducts': top_products_list,
             'categories': categories_list
-        }), 200
+        }
         
-    except Exception as e:
-        print(f"Error in product report: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'message': f'Error generating report: {str(e)}'}), 500
     finally:
         cursor.close()
 
@@ -2072,8 +3911,9 @@ def get_product_reports(current_user):
 @token_required
 @role_required(['admin'])
 def get_user_reports(current_user):
-    time_range = request.args.get('timeRange', 'week')
-    
+    return report_response('users', build_user_report)
+
+def build_user_report(time_range):
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
@@ -2092,61 +3932,443 @@ def get_user_reports(current_user):
         
         user_counts = cursor.fetchone()
         
-        # Get time period based on time_range for growth data
-        date_range = "1 month"
-        interval_unit = "day"
-        
-        if time_range == 'day':
-            date_range = "1 day"
-            interval_unit = "hour"
-        elif time_range == 'week':
-            date_range = "7 days"
-            interval_unit = "day"
-        elif time_range == 'month':
-            date_range = "1 month"
-            interval_unit = "day"
-        elif time_range == 'year':
-            date_range = "1 year"
-            interval_unit = "month"
-            
-        # Get user growth over time
+        # Gap-filled signup counts per bucket; an empty bucket still gets a zero
+        growth_range, growth_unit, label_format = USER_GROWTH_RANGES.get(time_range, USER_GROWTH_RANGES['month'])
         cursor.execute(
-            f"""
-            SELECT 
-                to_char(date_trunc('{interval_unit}', created_at), 'Mon DD') as month,
-                COUNT(*) as count
-            FROM users
-            WHERE created_at >= CURRENT_DATE - INTERVAL '{date_range}'
-            GROUP BY date_trunc('{interval_unit}', created_at)
-            ORDER BY date_trunc('{interval_unit}', created_at)
             """
+            SELECT 
+                to_char(b.bucket, %(label)s) as month,
+                COALESCE(c.count, 0) as count
+            FROM generate_series(
+                date_trunc(%(unit)s, CURRENT_DATE - %(range)s::interval),
+                date_trunc(%(unit)s, LOCALTIMESTAMP),
+                ('1 ' || %(unit)s)::interval
+            ) as b(bucket)
+            LEFT JOIN (
+                SELECT date_trunc(%(unit)s, created_at) as bucket, COUNT(*) as count
+                FROM users
+                WHERE created_at >= CURRENT_DATE - %(range)s::interval
+                GROUP BY 1
+            ) c ON c.bucket = b.bucket
+            ORDER BY b.bucket
+            """,
+            {'unit': growth_unit, 'range': growth_range, 'label': label_format}
         )
         
-        growth_data = cursor.fetchall()
         growth_list = []
-        
-        for item in growth_data:
+        for item in cursor.fetchall():
             growth_list.append({
                 'month': item['month'],
                 'count': item['count']
             })
             
-        return jsonify({
+        return {
             'totalUsers': user_counts['total'],
             'farmers': user_counts['farmers'],
             'buyers': user_counts['buyers'],
             'growth': growth_list
-        }), 200
+        }
         
-    except Exception as e:
-        print(f"Error in user report: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'message': f'Error generating report: {str(e)}'}), 500
     finally:
         cursor.close()
 
+# Async Serving (ASGI)
+# `python backend.py serve-async` serves the same API from one event loop.
+# Chat streams and exports run natively on the loop with an asyncio pool of
+# psycopg2 async connections, so an open stream or a slow download holds
+# neither a thread nor, for streams, a connection. Every other route is the
+# regular Flask view, run on a bounded thread pool.
+async def wait_for_connection(conn):
+    """Drive a psycopg2 async connection until its current operation completes"""
+    loop = asyncio.get_running_loop()
+    while True:
+        state = conn.poll()
+        if state == POLL_OK:
+            return
+        
+        ready = loop.create_future()
+        def wake():
+            if not ready.done():
+                ready.set_result(None)
+        
+        fd = conn.fileno()
+        if state == POLL_READ:
+            loop.add_reader(fd, wake)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        elif state == POLL_WRITE:
+            loop.add_writer(fd, wake)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(fd)
+        else:
+            raise psycopg2.OperationalError(f"Unexpected poll state: {state}")
+
+class AsyncConnectionPool:
+    """Bounded pool of psycopg2 async connections for one event loop.
+
+    Async connections are always in autocommit mode, so multi-statement
+    work issues BEGIN/COMMIT itself. Callers wait for a free connection
+    instead of failing when the pool is exhausted.
+    """
+    
+    def __init__(self, dsn_config, maxconn):
+        self.dsn_config = dsn_config
+        self.maxconn = maxconn
+        self.idle = []
+        self.size = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.available = None
+    
+    async def acquire(self):
+        if self.available is None:
+            self.available = asyncio.Condition()
+        
+        started = time.monotonic()
+        async with self.available:
+            self.waiting += 1
+            try:
+                while not self.idle and self.size >= self.maxconn:
+                    await self.available.wait()
+            finally:
+                self.waiting -= 1
+            self.checkouts += 1
+            self.wait_seconds += time.monotonic() - started
+            if self.idle:
+                return self.idle.pop()
+            self.size += 1
+        
+        try:
+            conn = psycopg2.connect(async_=1, **self.dsn_config)
+            await wait_for_connection(conn)
+            return conn
+        except Exception:
+            await self.release(None)
+            raise
+    
+    async def release(self, conn, discard=False):
+        async with self.available:
+            if conn is not None and not conn.closed and not discard:
+                self.idle.append(conn)
+            else:
+                if conn is not None and not conn.closed:
+                    conn.close()
+                self.size -= 1
+            self.available.notify()
+    
+    async def execute(self, conn, query, params=None):
+        """Run one statement and return its rows as dicts, or None if it returns none"""
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            cursor.execute(query, params)
+            await wait_for_connection(conn)
+            return cursor.fetchall() if cursor.description else None
+        finally:
+            cursor.close()
+    
+    async def close(self):
+        for conn in self.idle:
+            conn.close()
+        self.size -= len(self.idle)
+        self.idle = []
+    
+    def stats(self):
+        return {
+            'in_use': self.size - len(self.idle),
+            'idle': len(self.idle),
+            'waiting': self.waiting,
+            'max': self.maxconn,
+            'checkouts': self.checkouts,
+            'timeouts': 0,
+            'wait_seconds': self.wait_seconds,
+        }
+
+async_db_pool = AsyncConnectionPool(DB_CONFIG, app.config['ASYNC_DB_POOL_SIZE'])
+wsgi_executor = ThreadPoolExecutor(max_workers=app.config['ASYNC_WSGI_THREADS'], thread_name_prefix='wsgi')
+
+class AsyncChatSubscriber:
+    """Chat broker subscriber that hands messages to an asyncio queue"""
+    
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=CHAT_STREAM_QUEUE_SIZE)
+    
+    def put_nowait(self, chat):
+        # Called from the broker's listener thread
+        self.loop.call_soon_threadsafe(self.deliver, chat)
+    
+    def deliver(self, chat):
+        try:
+            self.queue.put_nowait(chat)
+        except asyncio.QueueFull:
+            print(f"Dropping chat {chat.get('id')} for a lagging stream subscriber")
+
+def check_native_request(environ):
+    """Apply the rate limit and token check the Flask route would.
+    
+    Returns (current_user, None), or (None, (message, status)).
+    """
+    with app.request_context(environ):
+        try:
+            limiter.check()
+        except RateLimitExceeded as e:
+            return None, (f'Rate limit exceeded: {e.description}', 429)
+        
+        current_user, error = authenticate(request.headers.get('Authorization'))
+        if error:
+            return None, (error, 401)
+        return current_user, None
+
+async def asgi_check_request(scope):
+    """Check a natively served ASGI request; token checks may poll the database, so run them off the loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(wsgi_executor, check_native_request, wsgi_environ(scope, b''))
+
+def cors_headers():
+    """The CORS header Flask-CORS adds, for responses that do not go through Flask"""
+    return [(b'access-control-allow-origin', CORS_ORIGINS.encode('latin-1'))]
+
+async def send_json(send, status, body):
+    payload = app.json.dumps(body).encode('utf-8')
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers + cors_headers()})
+    await send({'type': 'http.response.body', 'body': payload})
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+async def async_stream_messages(scope, receive, send, current_user):
+    """Async version of GET /api/chats/stream"""
+    user_id = current_user['id']
+    subscriber = AsyncChatSubscriber(asyncio.get_running_loop())
+    chat_broker.subscribe(user_id, subscriber)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ] + cors_headers()})
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+        
+        while True:
+            next_chat = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait({next_chat, disconnected}, timeout=CHAT_STREAM_HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if next_chat not in done:
+                next_chat.cancel()
+            if disconnected in done:
+                break
+            
+            if next_chat in done:
+                chat = next_chat.result()
+                event = f"id: {chat['id']}\nevent: message\ndata: {json.dumps(chat)}\n\n"
+            else:
+                event = ': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    finally:
+        disconnected.cancel()
+        chat_broker.unsubscribe(user_id, subscriber)
+
+async def async_export_table(scope, receive, send, table, export_format):
+    """Async version of GET /api/admin/export/<table>, reading through a DECLAREd cursor"""
+    conn = await async_db_pool.acquire()
+    discard = False
+    started = False
+    try:
+        await async_db_pool.execute(conn, 'BEGIN READ ONLY')
+        await async_db_pool.execute(conn, f'DECLARE export_rows NO SCROLL CURSOR FOR {EXPORT_QUERIES[table]}')
+        
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in export_headers(table, export_format).items()]
+        headers += cors_headers()
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        started = True
+        
+        wrote_header = False
+        while True:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            try:
+                cursor.execute(f'FETCH FORWARD {EXPORT_ITERSIZE} FROM export_rows')
+                await wait_for_connection(conn)
+                rows = cursor.fetchall()
+                columns = [column.name for column in cursor.description]
+            finally:
+                cursor.close()
+            
+            chunk = format_export_rows(rows, columns, export_format, not wrote_header)
+            wrote_header = True
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+            if len(rows) < EXPORT_ITERSIZE:
+                break
+        
+        await send({'type': 'http.response.body', 'body': b''})
+    except Exception as e:
+        discard = True
+        print(f"Export failed: {str(e)}")
+        if not started:
+            await send_json(send, 500, {'message': f'Error exporting {table}: {str(e)}'})
+        else:
+            # Headers are already sent, so the truncated body is all we can signal
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if not discard:
+            try:
+                await async_db_pool.execute(conn, 'ROLLBACK')
+            except Exception:
+                discard = True
+        await async_db_pool.release(conn, discard=discard)
+
+def wsgi_environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP request"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def call_wsgi(environ):
+    """Run the Flask app for one request and collect the whole response"""
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    
+    result = app.wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+async def asgi_bridge(scope, receive, send):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    
+    loop = asyncio.get_running_loop()
+    status, headers, response_body = await loop.run_in_executor(wsgi_executor, call_wsgi, wsgi_environ(scope, body))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response_body})
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point: native async routes, everything else through Flask"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_db_pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    if scope['type'] != 'http':
+        return
+    
+    path = scope['path']
+    export_prefix = '/api/admin/export/'
+    if scope['method'] == 'GET' and (path == '/api/chats/stream' or path.startswith(export_prefix)):
+        current_user, error = await asgi_check_request(scope)
+        if error:
+            return await send_json(send, error[1], {'message': error[0]})
+        
+        if path == '/api/chats/stream':
+            return await async_stream_messages(scope, receive, send, current_user)
+        
+        if current_user['role'] != 'admin':
+            return await send_json(send, 403, {'message': 'Permission denied!'})
+        table = path[len(export_prefix):]
+        args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        export_format = args.get('format', 'ndjson')
+        error = export_request_error(table, export_format)
+        if error:
+            return await send_json(send, error[1], {'message': error[0]})
+        return await async_export_table(scope, receive, send, table, export_format)
+    
+    await asgi_bridge(scope, receive, send)
+
+# Check the schema when imported by a WSGI server such as gunicorn
+if __name__ != '__main__':
+    with app.app_context():
+        check_schema_version()
+    # With --preload this runs in the master; workers open their own connections
+    db_pool.closeall()
+
 # Main entry point
 if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False) 
+    command = sys.argv[1] if len(sys.argv) > 1 else 'serve'
+    
+    if command == 'migrate':
+        # Apply schema migrations and make sure the admin account exists
+        with app.app_context():
+            run_migrations()
+            create_admin_user()
+    elif command == 'seed':
+        # Load sample farmers, buyers, products and chats into an empty database
+        with app.app_context():
+            add_test_data()
+    elif command == 'bench-checkout':
+        # Concurrent checkouts of one product: python backend.py bench-checkout [clients] [stock] [attempts]
+        args = [int(arg) for arg in sys.argv[2:5]]
+        with app.app_context():
+            check_schema_version()
+            benchmark_checkout(*args)
+    elif command == 'serve':
+        with app.app_context():
+            check_schema_version()
+        
+        port = int(os.environ.get('PORT', 5000))
+        app.run(host='0.0.0.0', port=port, debug=False)
+    elif command == 'serve-async':
+        if uvicorn is None:
+            print("serve-async needs an ASGI server: pip install uvicorn")
+            sys.exit(2)
+        with app.app_context():
+            check_schema_version()
+        
+        port = int(os.environ.get('PORT', 5000))
+        uvicorn.run(asgi_app, host='0.0.0.0', port=port)
+    else:
+        print(f"Unknown command: {command}")
+        print("Usage: python backend.py [serve|serve-async|migrate|seed|bench-checkout]")
+        sys.exit(2) 